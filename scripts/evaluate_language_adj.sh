@@ -4,6 +4,11 @@
 #
 # e.g.,
 # ../scripts/evaluate_language.sh ../data/agg/en.txt es google
+#
+# Set GENDER_SERVER (e.g., http://localhost:8765) to use a running predictor_server.py
+# Cached cells are stored in WINOMT_CACHE (default: ../cache/cells)
+# Set PRED_CACHE (e.g., ../cache/predictions.sqlite) to share predictions across runs
+# Alignments are stored in ALIGN_STORE (default: ../cache/alignments)
 
 set -e
 
@@ -11,6 +16,8 @@ set -e
 dataset=$1
 lang=$2
 trans_sys=$3
+cache_dir=${WINOMT_CACHE:-../cache/cells}
+align_store=${ALIGN_STORE:-../cache/alignments}
 prefix=adj.en-$lang
 
 # Prepare files for translation
@@ -26,14 +33,18 @@ else
     echo "Not translating since translation file exists: $trans_fn"
 fi
 
-# Align
-align_fn=forward.$prefix.align
-../../fast_align/build/fast_align -i $trans_fn  -d -o -v > $align_fn
-
-# Evaluate
+# Reuse a cached evaluation of unchanged inputs
 mkdir -p ../data/human/$trans_sys/$lang/
 out_fn=../data/human/$trans_sys/$lang/${lang}.pred.csv
-python load_alignments.py --ds=$dataset  --bi=$trans_fn --align=$align_fn --lang=$lang --out=$out_fn
+if python cell_cache.py --cache=$cache_dir --ds=$dataset --bi=$trans_fn --lang=$lang --out=$out_fn; then
+    exit 0
+fi
+
+# Align (reuses the stored alignment if the translations didn't change)
+align_fn=`python alignment_store.py --bi=$trans_fn --store=$align_store`
+
+# Evaluate
+python load_alignments.py --ds=$dataset  --bi=$trans_fn --align=$align_fn --lang=$lang --out=$out_fn --cache=$cache_dir ${GENDER_SERVER:+--server=$GENDER_SERVER} ${PRED_CACHE:+--pred-cache=$PRED_CACHE}
 
 # Prepare files for human annots
 # human_fn=../data/human/$trans_sys/$lang/${lang}.in.csv
@@ -1,6 +1,16 @@
 #!/bin/bash
 # Usage:
-#   evaluate_single_file.sh <gold> <predicted> <lang> <log>
+#   evaluate_single_file.sh <gold> <predicted> <lang> <log> [<name>=<subset-gold> ...]
+#
+# Each <name>=<subset-gold> adds a "<name>;;;metrics" line for the instances of <subset-gold>
+# (e.g., pro-stereotypical=../data/aggregates/en_pro.txt), from the same predictions.
+#
+# Set GENDER_SERVER (e.g., http://localhost:8765) to use a running predictor_server.py
+# Cached cells are stored in WINOMT_CACHE (default: ../cache/cells)
+# Set PRED_CACHE (e.g., ../cache/predictions.sqlite) to share predictions across runs
+# Set RESULTS_STORE (e.g., ../results/results.jsonl) to also record the metrics there (see generate_table.py)
+# Set INSTANCE_STORE (e.g., ../results/instances) to also write the per-instance predictions there (see instance_store.py)
+# Alignments are stored in ALIGN_STORE (default: ../cache/alignments)
 #
 
 set -e
@@ -10,16 +20,24 @@ gold=$1
 pred=$2
 lang=$3
 log=$4
+cache_dir=${WINOMT_CACHE:-../cache/cells}
+align_store=${ALIGN_STORE:-../cache/alignments}
+out_fn=${pred}.pred.csv
+subsets=""
+for subset in "${@:5}"
+do
+    subsets="$subsets --subset=$subset"
+done
 
-# Align
-align_fn=${pred}.forward.align
-if [ ! -f $align_fn ]; then
-    $FAST_ALIGN_BASE/build/fast_align -i $pred  -d -o -v > $align_fn
-else
-    echo "Skipping alignment since file exists: $align_fn"
+# Reuse a cached evaluation of unchanged inputs
+# (with subsets or a results or instance store, load_alignments.py restores it and adds the subset metrics)
+if [ -z "$subsets" ] && [ -z "$RESULTS_STORE" ] && [ -z "$INSTANCE_STORE" ] && python cell_cache.py --cache=$cache_dir --ds=$gold --bi=$pred --lang=$lang --out=$out_fn >> $log; then
+    exit 0
 fi
 
+# Align (reuses the stored alignment if the translations didn't change)
+align_fn=`python alignment_store.py --bi=$pred --store=$align_store --csr`
+
 # Evaluate
-out_fn=${pred}.pred.csv
-python load_alignments.py --ds=$gold  --bi=$pred --align=$align_fn --lang=$lang --out=$out_fn >> $log
+python load_alignments.py --ds=$gold  --bi=$pred --align=$align_fn --lang=$lang --out=$out_fn --cache=$cache_dir ${GENDER_SERVER:+--server=$GENDER_SERVER} ${PRED_CACHE:+--pred-cache=$PRED_CACHE} ${RESULTS_STORE:+--store=$RESULTS_STORE} ${INSTANCE_STORE:+--instances=$INSTANCE_STORE} $subsets >> $log
 
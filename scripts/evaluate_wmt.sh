@@ -3,6 +3,7 @@
 #   evaluate_wmt.sh <lang-fn> <output-file>
 # for example:
 #   evaluate_wmt.sh en-de.txt ./log.txt
+# See src/evaluate_wmt.py to evaluate the systems in parallel.
 set -e
 
 lang=$1
@@ -24,13 +25,10 @@ do
     trans=$wmtbase/$system/$lang
     if [ -f $trans ]; then
         printf "$system\n" >> $outfn
-        python split_translations.py --pro=$progold --ant=$antgold --trans=$trans
         printf "all;;;" >> $outfn
-        ../scripts/evaluate_single_file.sh $allgold $trans $targetlang $outfn
-        printf "pro-stereotypical;;;" >> $outfn
-        ../scripts/evaluate_single_file.sh $progold ${trans}.pro $targetlang $outfn
-        printf "anti-stereotypical;;;" >> $outfn
-        ../scripts/evaluate_single_file.sh $antgold ${trans}.ant $targetlang $outfn
+        # Align and predict once, pro and anti metrics are computed over the same predictions
+        ../scripts/evaluate_single_file.sh $allgold $trans $targetlang $outfn \
+            pro-stereotypical=$progold anti-stereotypical=$antgold
     fi
 done
 
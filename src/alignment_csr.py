@@ -0,0 +1,125 @@
+""" Usage:
+    <file-name> --in=ALIGN_FILE --out=CSR_FOLDER [--debug]
+
+Convert fast_align's text output into a compact, memory-mappable CSR format.
+CSR_FOLDER holds three .npy arrays:
+    line_offsets.npy  int64, per line, offsets into the link arrays (num_lines + 1)
+    src.npy           int32, source index of each link, sorted within each line
+    tgt.npy           int32, target index of each link
+"""
+# External imports
+import logging
+import pdb
+import os
+import shutil
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+from pprint import pprint
+from pprint import pformat
+from docopt import docopt
+from tqdm import tqdm
+from typing import List
+import numpy as np
+
+# Local imports
+
+#=-----
+
+CSR_ARRAYS = ["line_offsets", "src", "tgt"]
+
+
+def is_csr(path: str) -> bool:
+    """
+    Check if path holds a converted alignment.
+    """
+    return os.path.isdir(path) and \
+        all(os.path.exists(os.path.join(path, f"{name}.npy")) for name in CSR_ARRAYS)
+
+def convert_alignments(align_fn: str, out_folder: str):
+    """
+    Stream fast_align's output into CSR arrays.
+    Links are kept in order of source index within each line.
+    """
+    line_offsets = array("q", [0])
+    srcs = array("i")
+    tgts = array("i")
+    for line in tqdm(open(align_fn, encoding = "utf8"), desc = "converting"):
+        links = sorted(tuple(map(int, word.split("-"))) for word in line.split())
+        for src, tgt in links:
+            srcs.append(src)
+            tgts.append(tgt)
+        line_offsets.append(len(srcs))
+
+    os.makedirs(out_folder, exist_ok = True)
+    np.save(os.path.join(out_folder, "line_offsets.npy"), np.frombuffer(line_offsets, dtype = np.int64))
+    np.save(os.path.join(out_folder, "src.npy"), np.frombuffer(srcs, dtype = np.int32))
+    np.save(os.path.join(out_folder, "tgt.npy"), np.frombuffer(tgts, dtype = np.int32))
+
+def ensure_csr(align_fn: str, csr_folder: str) -> str:
+    """
+    Convert align_fn into csr_folder, unless it's already converted.
+    The conversion is written to a temporary folder and renamed into place,
+    so readers never see partial arrays.
+    """
+    if not is_csr(csr_folder):
+        tmp_folder = tempfile.mkdtemp(dir = os.path.dirname(os.path.abspath(csr_folder)), suffix = ".tmp")
+        convert_alignments(align_fn, tmp_folder)
+        try:
+            os.rename(tmp_folder, csr_folder)
+        except OSError:
+            # Converted concurrently by another process
+            shutil.rmtree(tmp_folder)
+    return csr_folder
+
+
+class LineAlignment:
+    """
+    Alignment of a single line, looked up lazily in the CSR arrays.
+    Indexing by a source index returns its target indices, like the
+    defaultdict(list) produced by read_alignments.
+    """
+    def __init__(self, src: List[int], tgt: List[int]):
+        self.src = src
+        self.tgt = tgt
+
+    def __getitem__(self, src_ind: int) -> List[int]:
+        start = bisect_left(self.src, src_ind)
+        end = bisect_right(self.src, src_ind, start)
+        return self.tgt[start : end]
+
+
+class CsrAlignments:
+    """
+    Memory-mapped alignments of a whole file. Only the pages holding
+    the requested lines are read from disk.
+    """
+    def __init__(self, folder: str):
+        self.line_offsets = np.load(os.path.join(folder, "line_offsets.npy"), mmap_mode = "r")
+        self.src = np.load(os.path.join(folder, "src.npy"), mmap_mode = "r")
+        self.tgt = np.load(os.path.join(folder, "tgt.npy"), mmap_mode = "r")
+
+    def __len__(self) -> int:
+        return len(self.line_offsets) - 1
+
+    def __getitem__(self, line_ind: int) -> LineAlignment:
+        if not (0 <= line_ind < len(self)):
+            raise IndexError(line_ind)
+        start, end = self.line_offsets[line_ind : line_ind + 2]
+        return LineAlignment(self.src[start : end].tolist(), self.tgt[start : end].tolist())
+
+
+if __name__ == "__main__":
+    # Parse command line arguments
+    args = docopt(__doc__)
+    inp_fn = args["--in"]
+    out_folder = args["--out"]
+    debug = args["--debug"]
+    if debug:
+        logging.basicConfig(level = logging.DEBUG)
+    else:
+        logging.basicConfig(level = logging.INFO)
+
+    convert_alignments(inp_fn, out_folder)
+
+    logging.info("DONE")
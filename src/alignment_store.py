@@ -0,0 +1,122 @@
+""" Usage:
+    <file-name> --bi=IN_FILE [--store=STORE_DIR] [--params=FAST_ALIGN_PARAMS] [--csr] [--debug]
+
+Print the path of a fast_align alignment for IN_FILE.
+Alignments are stored by the content hash of the bitext and the fast_align
+options, so fast_align only runs when the bitext (or the options) changed.
+FAST_ALIGN_PARAMS defaults to "-d -o -v".
+With --csr, print the path of a memory-mappable copy instead (see alignment_csr.py).
+"""
+# External imports
+import logging
+import pdb
+import os
+import hashlib
+import subprocess
+import tempfile
+from pprint import pprint
+from pprint import pformat
+from docopt import docopt
+from typing import List
+
+# Local imports
+from alignment_csr import ensure_csr
+#=-----
+
+DEFAULT_STORE = "../cache/alignments"
+FAST_ALIGN_PARAMS = ["-d", "-o", "-v"]
+
+
+def file_hash(fn: str) -> str:
+    """
+    Sha256 of a file's content.
+    """
+    sha = hashlib.sha256()
+    with open(fn, "rb") as fin:
+        for block in iter(lambda: fin.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+def fast_align_binary() -> str:
+    """
+    Path to the fast_align binary, under $FAST_ALIGN_BASE.
+    """
+    if "FAST_ALIGN_BASE" not in os.environ:
+        logging.error("Environment variable FAST_ALIGN_BASE is not set.")
+        raise ValueError
+    return os.path.join(os.environ["FAST_ALIGN_BASE"], "build", "fast_align")
+
+
+class AlignmentStore:
+    """
+    Persistent fast_align outputs, keyed by bitext content and options.
+    A changed translation file hashes to a new key, so stale
+    alignments are never returned.
+    """
+    def __init__(self, store_dir: str = DEFAULT_STORE):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok = True)
+
+    def key(self, bi_fn: str, params: List[str] = FAST_ALIGN_PARAMS) -> str:
+        """
+        Hash of the bitext content and the fast_align options.
+        """
+        key_str = file_hash(bi_fn) + " " + " ".join(params)
+        return hashlib.sha256(key_str.encode("utf8")).hexdigest()
+
+    def path(self, key: str) -> str:
+        """
+        Location of an alignment in the store.
+        """
+        return os.path.join(self.store_dir, f"{key}.align")
+
+    def get(self, bi_fn: str, params: List[str] = FAST_ALIGN_PARAMS) -> str:
+        """
+        Return the path of the alignment for bi_fn, running fast_align
+        on a miss. The output is written to a temporary file and
+        renamed into place, so readers never see partial alignments.
+        """
+        align_fn = self.path(self.key(bi_fn, params))
+        if os.path.exists(align_fn):
+            logging.info(f"Reusing alignment for {bi_fn}: {align_fn}")
+            return align_fn
+
+        logging.info(f"Aligning {bi_fn} into {align_fn}")
+        fd, tmp_fn = tempfile.mkstemp(dir = self.store_dir, suffix = ".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding = "utf8") as fout:
+                subprocess.run([fast_align_binary(), "-i", bi_fn] + list(params),
+                               stdout = fout, check = True)
+            os.replace(tmp_fn, align_fn)
+        except:
+            os.remove(tmp_fn)
+            raise
+        return align_fn
+
+    def get_csr(self, bi_fn: str, params: List[str] = FAST_ALIGN_PARAMS) -> str:
+        """
+        Return the path of the CSR conversion of the alignment for bi_fn,
+        aligning and converting on a miss.
+        """
+        align_fn = self.get(bi_fn, params)
+        return ensure_csr(align_fn, align_fn[: -len(".align")] + ".csr")
+
+
+if __name__ == "__main__":
+    # Parse command line arguments
+    args = docopt(__doc__)
+    bi_fn = args["--bi"]
+    store_dir = args["--store"] or DEFAULT_STORE
+    params = args["--params"].split() if args["--params"] else FAST_ALIGN_PARAMS
+    csr = args["--csr"]
+    debug = args["--debug"]
+    if debug:
+        logging.basicConfig(level = logging.DEBUG)
+    else:
+        logging.basicConfig(level = logging.INFO)
+
+    store = AlignmentStore(store_dir)
+    if csr:
+        print(store.get_csr(bi_fn, params))
+    else:
+        print(store.get(bi_fn, params))
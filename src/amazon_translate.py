@@ -12,12 +12,15 @@ from operator import itemgetter
 from tqdm import tqdm
 import boto3
 import html
+import os
 
 # Local imports
 
 #=-----
 
-AWS_TRANSLATE_CLIENT = boto3.client(service_name='translate', use_ssl=True)
+# AWS_TRANSLATE_ENDPOINT overrides the service's endpoint (e.g., a local stub server for testing)
+AWS_TRANSLATE_CLIENT = boto3.client(service_name='translate', use_ssl=True,
+                                    endpoint_url=os.environ.get("AWS_TRANSLATE_ENDPOINT"))
 
 def aws_translate(sents, target_language, source_language):
     """
@@ -1,5 +1,8 @@
 """ Usage:
-    <file-name> --in=IN_FILE --src=SOURCE_LANGUAGE --tgt=TARGET_LANGUAGE --out=OUT_FILE [--debug]
+    <file-name> --in=IN_FILE --src=SOURCE_LANGUAGE --tgt=TARGET_LANGUAGE --out=OUT_FILE [--workers=NUM_WORKERS] [--rate=REQUESTS_PER_SEC] [--debug]
+
+Requests go to BING_TRANSLATOR_ENDPOINT, if set (e.g., a local stub server for testing).
+See BingTranslator for the other settings.
 """
 # External imports
 import logging
@@ -11,77 +14,113 @@ from collections import defaultdict
 from operator import itemgetter
 from tqdm import tqdm
 import os, requests, uuid, json
+import threading
+from requests.adapters import HTTPAdapter
 import html
 
 # Local imports
-
+from translation_engine import TranslationEngine
 #=-----
 
-BATCH_SIZE = 10
+BING_ENDPOINT = "https://api.cognitive.microsofttranslator.com"
+POOL_SIZE = 16          # Connections kept alive, should cover the in-flight requests
+TIMEOUT = 60            # Seconds
 
-def bing_translate(sents, target_language, source_language = None):
+
+class BingTranslator:
     """
-    Run bing translate on a batch of sentences.
+    Reusable Bing translator client.
+    The configuration is read once, and requests go through a pooled
+    requests.Session, which keeps TLS connections alive across batches.
+    Environment variables:
+        BING_TRANSLATOR_TEXT_KEY: subscription key (required).
+        BING_TRANSLATOR_ENDPOINT: service URL (e.g., a local stub server for testing).
+        BING_TRANSLATOR_REGION: resource region, for regional subscriptions.
+    compress: ask for gzip compressed responses.
     """
-    # Checks to see if the Translator Text subscription key is available as an environment variable.
-    if 'BING_TRANSLATOR_TEXT_KEY' in os.environ:
-        subscriptionKey = os.environ['BING_TRANSLATOR_TEXT_KEY']
-    else:
-        logging.error('Environment variable for BING_TRANSLATOR_TEXT_KEY is not set.')
-        raise ValueError
-
-    # If you encounter any issues with the base_url or path, make sure
-    # that you are using the latest endpoint: https://docs.microsoft.com/azure/cognitive-services/translator/reference/v3-0-translate
-    base_url = "https://api.cognitive.microsofttranslator.com"
-    path = "/translate?api-version=3.0"
-    params = f"&to={target_language}"
-    constructed_url = base_url + path + params
-
-    headers = {
-        'Ocp-Apim-Subscription-Key': subscriptionKey,
-        'Content-type': 'application/json',
-        'X-ClientTraceId': str(uuid.uuid4())
-    }
-    trans = []
-
-
-    # You can pass more than one object in body.
-    body = [{'text' : sent} for sent in sents]
-    request = requests.post(constructed_url, headers=headers, json=body)
-    response = request.json()
-
-    if (len(response) != len(sents)):
-        pdb.set_trace()
-        raise AssertionError
-
-    trans = []
-    for (cur_resp, sent) in zip(response, sents):
-        cur_trans = cur_resp["translations"]
-        if len(cur_trans) != 1:
-            pdb.set_trace()
-            raise AssertionError
-        cur_trans = cur_trans[0]
-        trans.append({"translatedText": cur_trans["text"],
-                      "input": sent})
-    return trans
-
-def chunks(l, n):
+    def __init__(self, subscription_key = None, endpoint = None, region = None,
+                 pool_size = POOL_SIZE, compress = True, timeout = TIMEOUT):
+        # Checks to see if the Translator Text subscription key is available as an environment variable.
+        subscription_key = subscription_key or os.environ.get('BING_TRANSLATOR_TEXT_KEY')
+        if subscription_key is None:
+            logging.error('Environment variable for BING_TRANSLATOR_TEXT_KEY is not set.')
+            raise ValueError
+        region = region or os.environ.get('BING_TRANSLATOR_REGION')
+
+        # If you encounter any issues with the base_url or path, make sure
+        # that you are using the latest endpoint: https://docs.microsoft.com/azure/cognitive-services/translator/reference/v3-0-translate
+        base_url = endpoint or os.environ.get("BING_TRANSLATOR_ENDPOINT", BING_ENDPOINT)
+        self.url = base_url.rstrip("/") + "/translate"
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            'Ocp-Apim-Subscription-Key': subscription_key,
+            'Content-type': 'application/json',
+            'Accept-Encoding': 'gzip' if compress else 'identity',
+        })
+        if region is not None:
+            self.session.headers['Ocp-Apim-Subscription-Region'] = region
+
+    def translate(self, sents, target_language, source_language = None):
+        """
+        Run bing translate on a batch of sentences.
+        """
+        # You can pass more than one object in body.
+        body = [{'text' : sent} for sent in sents]
+        request = self.session.post(self.url,
+                                    params = {"api-version": "3.0", "to": target_language},
+                                    headers = {'X-ClientTraceId': str(uuid.uuid4())},
+                                    json = body, timeout = self.timeout)
+        request.raise_for_status()
+        response = request.json()
+
+        if (len(response) != len(sents)):
+            raise ValueError(f"Got {len(response)} translations for {len(sents)} sentences")
+
+        trans = []
+        for (cur_resp, sent) in zip(response, sents):
+            cur_trans = cur_resp["translations"]
+            if len(cur_trans) != 1:
+                raise ValueError(f"Got {len(cur_trans)} translations for: {sent}")
+            cur_trans = cur_trans[0]
+            trans.append({"translatedText": cur_trans["text"],
+                          "input": sent})
+        return trans
+
+    def close(self):
+        self.session.close()
+
+
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+def get_client() -> BingTranslator:
+    """
+    The client shared by bing_translate calls, created on first use.
+    """
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = BingTranslator()
+    return _CLIENT
+
+def bing_translate(sents, target_language, source_language = None):
     """
-    Yield successive n-sized chunks from l.
+    Run bing translate on a batch of sentences, with the shared client.
     """
-    for i in range(0, len(l), n):
-        yield l[i:i + n]
+    return get_client().translate(sents, target_language, source_language)
 
-def batch_translate(lines, tgt_lang, src_lang = None):
+def batch_translate(lines, tgt_lang, src_lang = None, **settings):
     """
     Translate a list of sentences.
-    Take care of batching.
+    Take care of batching, concurrency, rate limits and retries.
     """
-    translations_dicts = []
-    for chunk in tqdm(list(chunks(lines, BATCH_SIZE)), desc=f"size {BATCH_SIZE} chunks"):
-        for out_dict in bing_translate(chunk, tgt_lang, src_lang):
-            translations_dicts.append(out_dict)
-    return translations_dicts
+    engine = TranslationEngine.for_provider("bing", bing_translate, **settings)
+    return engine.translate(lines, tgt_lang, src_lang)
 
 if __name__ == "__main__":
     # Parse command line arguments
@@ -90,6 +129,8 @@ if __name__ == "__main__":
     src_lang = args["--src"]
     tgt_lang = args["--tgt"]
     out_fn = args["--out"]
+    num_workers = int(args["--workers"]) if args["--workers"] else None
+    rate = float(args["--rate"]) if args["--rate"] else None
     debug = args["--debug"]
     if debug:
         logging.basicConfig(level = logging.DEBUG)
@@ -97,7 +138,7 @@ if __name__ == "__main__":
         logging.basicConfig(level = logging.INFO)
 
     lines = [line.strip() for line in open(inp_fn, encoding = "utf8")]
-    out_dicts = batch_translate(lines, tgt_lang, src_lang)
+    out_dicts = batch_translate(lines, tgt_lang, src_lang, num_workers = num_workers, rate = rate)
     with open(out_fn, "w", encoding = "utf8") as fout:
         for out_dict in out_dicts:
             fout.write("{} ||| {}\n".format(out_dict["input"],
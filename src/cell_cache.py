@@ -0,0 +1,145 @@
+""" Usage:
+    <file-name> --cache=CACHE_DIR --ds=DATASET_FILE --bi=IN_FILE --lang=LANG --out=OUT_FILE [--align-params=PARAMS] [--debug]
+
+Look up an evaluation cell in the content-addressed cache.
+On a hit, copy the cached predictions to OUT_FILE, print the cached metrics and exit with 0.
+On a miss, exit with 1.
+"""
+# External imports
+import logging
+import pdb
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+from glob import glob
+from pprint import pprint
+from pprint import pformat
+from docopt import docopt
+from typing import Dict, List, Optional, Tuple
+
+# Local imports
+from alignment_store import FAST_ALIGN_PARAMS, file_hash
+#=-----
+
+DEFAULT_ALIGN_PARAMS = " ".join(FAST_ALIGN_PARAMS)
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Code and rule tables which determine the predictions,
+# including the in-process aligner and alignment reader
+LANGUAGE_FILES = ["languages/*.py", "languages/*.json"]
+ALIGNER_FILES = ["ibm2_aligner.py", "alignment_csr.py"]
+PREDICTOR_FILES = ["load_alignments.py", "evaluate.py"] + ALIGNER_FILES + LANGUAGE_FILES
+
+PREDICTIONS_FN = "pred.csv"
+METRICS_FN = "metrics.json"
+
+_fingerprints = {}
+
+def predictor_fingerprint(patterns: List[str] = PREDICTOR_FILES) -> str:
+    """
+    Version fingerprint of the predictor code and rule tables.
+    """
+    patterns = tuple(patterns)
+    if patterns not in _fingerprints:
+        sha = hashlib.sha256()
+        fns = sorted(fn for pattern in patterns
+                     for fn in glob(os.path.join(SRC_DIR, pattern)))
+        for fn in fns:
+            sha.update(os.path.relpath(fn, SRC_DIR).encode("utf8"))
+            sha.update(file_hash(fn).encode("utf8"))
+        _fingerprints[patterns] = sha.hexdigest()
+    return _fingerprints[patterns]
+
+
+class CellCache:
+    """
+    Content-addressed store of evaluation cells.
+    Each entry holds the per-instance predictions csv and the metrics dict.
+    """
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok = True)
+
+    def key(self, ds_fn: str, bi_fn: str, lang: str,
+            align_params: str = DEFAULT_ALIGN_PARAMS) -> str:
+        """
+        Key a cell by the content of its inputs and the predictor version.
+        """
+        key_dict = {"ds": file_hash(ds_fn),
+                    "bi": file_hash(bi_fn),
+                    "align_params": " ".join(align_params.split()),
+                    "lang": lang,
+                    "predictor": predictor_fingerprint()}
+        return hashlib.sha256(json.dumps(key_dict, sort_keys = True).encode("utf8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[str, Dict]]:
+        """
+        Return (predictions file, metrics) for a cached cell, or None.
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        metrics_fn = os.path.join(entry_dir, METRICS_FN)
+        if not os.path.exists(metrics_fn):
+            return None
+        with open(metrics_fn, encoding = "utf8") as fin:
+            metrics = json.load(fin)
+        return os.path.join(entry_dir, PREDICTIONS_FN), metrics
+
+    def put(self, key: str, pred_fn: str, metrics: Dict):
+        """
+        Store a computed cell.
+        Entries are written to a temporary folder and renamed into
+        place, so concurrent writers never expose partial entries.
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        if os.path.exists(entry_dir):
+            return
+        tmp_dir = tempfile.mkdtemp(dir = self.cache_dir)
+        shutil.copyfile(pred_fn, os.path.join(tmp_dir, PREDICTIONS_FN))
+        with open(os.path.join(tmp_dir, METRICS_FN), "w", encoding = "utf8") as fout:
+            json.dump(metrics, fout)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another process stored the same cell first
+            shutil.rmtree(tmp_dir)
+
+    def restore(self, key: str, out_fn: str) -> Optional[Dict]:
+        """
+        Copy a cached cell's predictions to out_fn and return its metrics,
+        or None on a miss.
+        """
+        hit = self.get(key)
+        if hit is None:
+            return None
+        pred_fn, metrics = hit
+        shutil.copyfile(pred_fn, out_fn)
+        return metrics
+
+
+if __name__ == "__main__":
+    # Parse command line arguments
+    args = docopt(__doc__)
+    cache_dir = args["--cache"]
+    ds_fn = args["--ds"]
+    bi_fn = args["--bi"]
+    lang = args["--lang"]
+    out_fn = args["--out"]
+    align_params = args["--align-params"] or DEFAULT_ALIGN_PARAMS
+    debug = args["--debug"]
+    if debug:
+        logging.basicConfig(level = logging.DEBUG)
+    else:
+        logging.basicConfig(level = logging.INFO)
+
+    cache = CellCache(cache_dir)
+    metrics = cache.restore(cache.key(ds_fn, bi_fn, lang, align_params), out_fn)
+    if metrics is None:
+        logging.info(f"Cache miss: {bi_fn}")
+        sys.exit(1)
+
+    print(json.dumps(metrics))
+    logging.info(f"Cache hit: {bi_fn}")
@@ -1,5 +1,11 @@
 """ Usage:
-    <file-name> --in=IN_FILE --out=OUT_FILE [--debug]
+    <file-name> --ds=DATASET_FILE --pred=PRED_FILE [--pro=PRO_FILE] [--anti=ANTI_FILE] [--bootstrap=NUM_SAMPLES] [--ci=CI] [--seed=SEED] [--debug]
+
+Print the gender bias metrics of a predictions file written by load_alignments.py.
+With --bootstrap, also print CI% (default 95) confidence intervals of acc, f1_male,
+f1_female, delta_g and delta_s, from NUM_SAMPLES resamples of the instances.
+delta_s compares the instances found in PRO_FILE and ANTI_FILE
+(default: ../data/aggregates/en_pro.txt and en_anti.txt).
 """
 # External imports
 import logging
@@ -8,98 +14,265 @@ import json
 from pprint import pprint
 from pprint import pformat
 from docopt import docopt
-from collections import defaultdict
-from operator import itemgetter
+import csv
 from tqdm import tqdm
 from typing import List, Dict
+import numpy as np
 
 # Local imports
 from languages.util import GENDER, WB_GENDER_TYPES
 #=-----
 
-def calc_f1(precision: float, recall: float) -> float:
+NUM_GENDERS = len(GENDER)
+EXCLUDED = NUM_GENDERS * NUM_GENDERS    # Code of instances left out of a confusion matrix
+
+DEFAULT_PRO_FN = "../data/aggregates/en_pro.txt"
+DEFAULT_ANTI_FN = "../data/aggregates/en_anti.txt"
+BOOTSTRAP_CHUNK = 1 << 24   # Max. sampled instances held in memory at once
+
+
+def calc_f1(precision, recall):
     """
-    Compute F1 from precision and recall.
+    Compute F1 from precision and recall (single values or arrays),
+    in NumPy, so it's nan rather than an error when both are 0.
     """
-    return 2 * (precision * recall) / (precision + recall)
+    precision = np.asarray(precision, dtype = float)
+    recall = np.asarray(recall, dtype = float)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        return 2 * (precision * recall) / (precision + recall)
 
+def round1(values):
+    """
+    Round to one decimal.
+    Single values (the reported metrics) use the builtin round, to stay bit-exact
+    with previously reported results: np.round scales by 10 first, which flips
+    some ties (e.g., 22.05). Arrays (e.g., bootstrap resamples) use np.round.
+    """
+    if np.ndim(values) == 0:
+        return round(float(values), 1)
+    return np.round(values, 1)
 
-def evaluate_bias(ds: List[str], predicted: List[GENDER]) -> Dict:
+def encode_instances(ds: List[List[str]], predicted: List[GENDER]) -> np.ndarray:
     """
-    (language independent)
-    Get performance metrics for gender bias.
+    Code each instance as gold * NUM_GENDERS + predicted,
+    or EXCLUDED for ignored words.
     """
     assert(len(ds) == len(predicted))
-    prof_dict = defaultdict(list)
-    conf_dict = defaultdict(lambda: defaultdict(lambda: 0))
-    total = defaultdict(lambda: 0)
-    pred_cnt = defaultdict(lambda: 0)
-    correct_cnt = defaultdict(lambda: 0)
+    gold = np.array([WB_GENDER_TYPES[entry[0]].value for entry in ds], dtype = np.int64)
+    pred = np.array([gender.value for gender in predicted], dtype = np.int64)
+    codes = gold * NUM_GENDERS + pred
+    codes[pred == GENDER.ignore.value] = EXCLUDED # skip analysis of ignored words
+    return codes
 
-    count_unknowns = defaultdict(lambda: 0)
+def confusion_matrix(codes: np.ndarray) -> np.ndarray:
+    """
+    Gold x predicted counts of coded instances.
+    """
+    counts = np.bincount(codes, minlength = EXCLUDED + 1)
+    return counts[: EXCLUDED].reshape(NUM_GENDERS, NUM_GENDERS)
 
-    for (gold_gender, word_ind, sent, profession), pred_gender in zip(ds, predicted):
-        if pred_gender == GENDER.ignore:
-            continue # skip analysis of ignored words
+def bias_metrics(conf: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    acc, f1_male and f1_female from gold x predicted confusion matrices
+    (shape [..., NUM_GENDERS, NUM_GENDERS]), rounded as in the reported numbers.
+    Empty denominators result in nan.
+    """
+    total = conf.sum(axis = -1)
+    pred_cnt = conf.sum(axis = -2)
+    correct = np.diagonal(conf, axis1 = -2, axis2 = -1)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        metrics = {"acc": round1((correct.sum(axis = -1) / total.sum(axis = -1)) * 100)}
+        for gender in [GENDER.male, GENDER.female]:
+            recall = round1((correct[..., gender.value] / total[..., gender.value]) * 100)
+            prec = round1((correct[..., gender.value] / pred_cnt[..., gender.value]) * 100)
+            metrics[f"f1_{gender.name}"] = round1(calc_f1(prec, recall))
+    return metrics
 
-        gold_gender = WB_GENDER_TYPES[gold_gender]
+class BiasAccumulator:
+    """
+    Mergeable counts behind the bias metrics: the gold x predicted confusion
+    matrix, overall and per profession.
+    Shards evaluated separately (in other processes or on other machines)
+    combine exactly with merge, or through to_dict / from_dict.
+    """
+    def __init__(self):
+        self.conf = np.zeros((NUM_GENDERS, NUM_GENDERS), dtype = np.int64)
+        self.professions = {}    # Lowercased profession -> its confusion matrix
 
-        if pred_gender == GENDER.unknown:
-            count_unknowns[gold_gender] += 1
+    def add(self, ds_entry: List[str], pred_gender: GENDER):
+        """
+        Count a single (gold, index, sentence, profession) instance.
+        """
+        if pred_gender == GENDER.ignore:
+            return # skip analysis of ignored words
+        gold_gender = WB_GENDER_TYPES[ds_entry[0]]
+        profession = ds_entry[3].lower()
+        if profession not in self.professions:
+            self.professions[profession] = np.zeros((NUM_GENDERS, NUM_GENDERS), dtype = np.int64)
+        self.conf[gold_gender.value, pred_gender.value] += 1
+        self.professions[profession][gold_gender.value, pred_gender.value] += 1
 
-        sent = sent.split()
-        profession = profession.lower()
-        if not profession:
-            pdb.set_trace()
+    def add_batch(self, ds: List[List[str]], predicted: List[GENDER]):
+        """
+        Count a list of instances, with one bincount per table.
+        """
+        codes = encode_instances(ds, predicted)
+        self.conf += confusion_matrix(codes)
 
-        total[gold_gender] += 1
+        prof_ids = {}
+        prof_inds = np.array([prof_ids.setdefault(entry[3].lower(), len(prof_ids)) for entry in ds],
+                             dtype = np.int64)
+        counts = np.bincount(prof_inds * (EXCLUDED + 1) + codes,
+                             minlength = len(prof_ids) * (EXCLUDED + 1))
+        counts = counts.reshape(len(prof_ids), EXCLUDED + 1)[:, : EXCLUDED]
+        for profession, prof_ind in prof_ids.items():
+            if not counts[prof_ind].any():
+                continue # all ignored
+            prof_conf = counts[prof_ind].reshape(NUM_GENDERS, NUM_GENDERS)
+            if profession in self.professions:
+                self.professions[profession] += prof_conf
+            else:
+                self.professions[profession] = prof_conf
 
-        if pred_gender == gold_gender:
-            correct_cnt[gold_gender] += 1
+    def merge(self, other: "BiasAccumulator") -> "BiasAccumulator":
+        """
+        Add the counts of another accumulator into this one.
+        """
+        self.conf += other.conf
+        for profession, prof_conf in other.professions.items():
+            if profession in self.professions:
+                self.professions[profession] += prof_conf
+            else:
+                self.professions[profession] = prof_conf.copy()
+        return self
 
-        pred_cnt[pred_gender] += 1
+    def finalize(self) -> Dict:
+        """
+        The metrics reported by evaluate_bias.
+        """
+        metrics = bias_metrics(self.conf)
+        return {"acc": float(metrics["acc"]),
+                "f1_male": float(metrics["f1_male"]),
+                "f1_female": float(metrics["f1_female"]),
+                "unk_male": int(self.conf[GENDER.male.value, GENDER.unknown.value]),
+                "unk_female": int(self.conf[GENDER.female.value, GENDER.unknown.value]),
+                "unk_neutral": int(self.conf[GENDER.neutral.value, GENDER.unknown.value])}
 
-        prof_dict[profession].append((pred_gender, gold_gender))
-        conf_dict[gold_gender][pred_gender] += 1
+    def profession_tallies(self) -> Dict[str, Dict]:
+        """
+        Per profession: number of instances, correct predictions and
+        counts of each predicted gender.
+        """
+        return {profession: {"total": int(prof_conf.sum()),
+                             "correct": int(np.trace(prof_conf)),
+                             "predicted": {gender.name: int(prof_conf[:, gender.value].sum())
+                                           for gender in GENDER if gender != GENDER.ignore}}
+                for profession, prof_conf in self.professions.items()}
 
-    prof_dict = dict(prof_dict)
-    all_total = sum(total.values())
-    acc = round((sum(correct_cnt.values()) / all_total) * 100, 1)
+    def to_dict(self) -> Dict:
+        """
+        Json serializable counts, e.g., to send a shard's result across machines.
+        """
+        return {"conf": self.conf.tolist(),
+                "professions": {profession: prof_conf.tolist()
+                                for profession, prof_conf in self.professions.items()}}
 
-    recall_male = round((correct_cnt[GENDER.male] / total[GENDER.male]) * 100, 1)
-    prec_male = round((correct_cnt[GENDER.male] / pred_cnt[GENDER.male]) * 100, 1)
-    f1_male = round(calc_f1(prec_male, recall_male), 1)
+    @classmethod
+    def from_dict(cls, counts: Dict) -> "BiasAccumulator":
+        accumulator = cls()
+        accumulator.conf = np.array(counts["conf"], dtype = np.int64)
+        accumulator.professions = {profession: np.array(prof_conf, dtype = np.int64)
+                                   for profession, prof_conf in counts["professions"].items()}
+        return accumulator
 
-    recall_female = round((correct_cnt[GENDER.female] / total[GENDER.female]) * 100, 1)
-    prec_female = round((correct_cnt[GENDER.female] / pred_cnt[GENDER.female]) * 100, 1)
-    f1_female = round(calc_f1(prec_female, recall_female), 1)
 
-    output_dict = {"acc": acc,
-                   "f1_male": f1_male,
-                   "f1_female": f1_female,
-                   "unk_male": count_unknowns[GENDER.male],
-                   "unk_female": count_unknowns[GENDER.female],
-                   "unk_neutral": count_unknowns[GENDER.neutral]}
+def evaluate_bias(ds: List[str], predicted: List[GENDER]) -> Dict:
+    """
+    (language independent)
+    Get performance metrics for gender bias.
+    """
+    accumulator = BiasAccumulator()
+    accumulator.add_batch(ds, predicted)
+    output_dict = accumulator.finalize()
     print(json.dumps(output_dict))
 
-    male_prof = [prof for prof, vals in prof_dict.items()
-                 if all(pred_gender == GENDER.male
-                        for pred_gender
-                        in map(itemgetter(0), vals))]
+    return output_dict
+
+def evaluate_subset(ds: List[List[str]], predicted: List[GENDER], mask: np.ndarray) -> Dict:
+    """
+    Metrics of the instances selected by mask (see subset_mask),
+    reusing the predictions made over the full dataset.
+    """
+    accumulator = BiasAccumulator()
+    accumulator.add_batch([entry for entry, keep in zip(ds, mask) if keep],
+                          [gender for gender, keep in zip(predicted, mask) if keep])
+    return accumulator.finalize()
+
+def resampled_confusions(codes: np.ndarray, samples: np.ndarray) -> np.ndarray:
+    """
+    Confusion matrix of each resample, where samples holds
+    the drawn instance indices ([num_samples, num_instances]).
+    """
+    num_samples = len(samples)
+    offsets = np.arange(num_samples)[:, None] * (EXCLUDED + 1)
+    counts = np.bincount((codes[samples] + offsets).ravel(),
+                         minlength = num_samples * (EXCLUDED + 1))
+    counts = counts.reshape(num_samples, EXCLUDED + 1)[:, : EXCLUDED]
+    return counts.reshape(num_samples, NUM_GENDERS, NUM_GENDERS)
+
+def bootstrap_bias(codes: np.ndarray, pro_mask: np.ndarray, anti_mask: np.ndarray,
+                   num_samples: int = 1000, ci: float = 95, seed: int = 0) -> Dict:
+    """
+    Percentile bootstrap confidence intervals for acc, f1_male, f1_female,
+    delta_g (f1_male - f1_female) and delta_s (acc on pro - acc on anti).
+    Instances are resampled with replacement, and the pro and anti subsets
+    are measured within each resample.
+    """
+    rng = np.random.default_rng(seed)
+    subsets = {"all": codes,
+               "pro": np.where(pro_mask, codes, EXCLUDED),
+               "anti": np.where(anti_mask, codes, EXCLUDED)}
 
-    female_prof = [prof for prof, vals in prof_dict.items()
-                   if all(pred_gender == GENDER.female
-                          for pred_gender
-                          in map(itemgetter(0), vals))]
+    def summary(metrics: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        return {"acc": metrics["all"]["acc"],
+                "f1_male": metrics["all"]["f1_male"],
+                "f1_female": metrics["all"]["f1_female"],
+                "delta_g": round1(metrics["all"]["f1_male"] - metrics["all"]["f1_female"]),
+                "delta_s": round1(metrics["pro"]["acc"] - metrics["anti"]["acc"])}
 
-    neutral_prof = [prof for prof, vals in prof_dict.items()
-                    if all(pred_gender == GENDER.neutral
-                           for pred_gender
-                           in map(itemgetter(0), vals))]
+    estimates = summary({name: bias_metrics(confusion_matrix(subset_codes))
+                         for name, subset_codes in subsets.items()})
 
-    amb_prof = [prof for prof, vals in prof_dict.items()
-                if len(set(map(itemgetter(0), vals))) != 1]
+    chunk_size = max(1, BOOTSTRAP_CHUNK // max(len(codes), 1))
+    resampled = []
+    for start in range(0, num_samples, chunk_size):
+        samples = rng.integers(0, len(codes), size = (min(chunk_size, num_samples - start), len(codes)))
+        resampled.append(summary({name: bias_metrics(resampled_confusions(subset_codes, samples))
+                                  for name, subset_codes in subsets.items()}))
 
+    low, high = (100 - ci) / 2, 100 - (100 - ci) / 2
+    output_dict = {}
+    for metric, estimate in estimates.items():
+        values = np.concatenate([chunk[metric] for chunk in resampled])
+        output_dict[metric] = {"estimate": float(estimate),
+                               "low": float(np.nanpercentile(values, low)),
+                               "high": float(np.nanpercentile(values, high))}
+    return output_dict
+
+def read_predictions(pred_fn: str) -> List[GENDER]:
+    """
+    Read the predicted genders from a load_alignments.py output file.
+    """
+    with open(pred_fn, encoding = "utf8") as fin:
+        pred_rows = list(csv.reader(fin, delimiter = ","))[1:]
+    return [GENDER[pred_gender] for _, pred_gender in pred_rows]
+
+def subset_mask(ds: List[List[str]], subset_fn: str) -> np.ndarray:
+    """
+    Mark the dataset instances which appear in the subset file.
+    """
+    subset = set(tuple(line.strip().split("\t")) for line in open(subset_fn, encoding = "utf8"))
+    return np.array([tuple(entry) in subset for entry in ds], dtype = bool)
 
 
 def percentage(part, total):
@@ -111,14 +284,26 @@ def percentage(part, total):
 if __name__ == "__main__":
     # Parse command line arguments
     args = docopt(__doc__)
-    inp_fn = args["--in"]
-    out_fn = args["--out"]
+    ds_fn = args["--ds"]
+    pred_fn = args["--pred"]
+    pro_fn = args["--pro"] or DEFAULT_PRO_FN
+    anti_fn = args["--anti"] or DEFAULT_ANTI_FN
+    num_samples = int(args["--bootstrap"]) if args["--bootstrap"] else None
+    ci = float(args["--ci"]) if args["--ci"] else 95
+    seed = int(args["--seed"]) if args["--seed"] else 0
     debug = args["--debug"]
     if debug:
         logging.basicConfig(level = logging.DEBUG)
     else:
         logging.basicConfig(level = logging.INFO)
 
+    ds = [line.strip().split("\t") for line in open(ds_fn, encoding = "utf8")]
+    predicted = read_predictions(pred_fn)
+    evaluate_bias(ds, predicted)
 
+    if num_samples:
+        codes = encode_instances(ds, predicted)
+        print(json.dumps(bootstrap_bias(codes, subset_mask(ds, pro_fn), subset_mask(ds, anti_fn),
+                                        num_samples, ci, seed)))
 
     logging.info("DONE")
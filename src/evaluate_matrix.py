@@ -0,0 +1,287 @@
+""" Usage:
+    <file-name> --ds=DATASET_FILE --out=OUTPUT_FOLDER [--langs=LANGS] [--systems=SYSTEMS] [--workers=NUM_WORKERS] [--cache=CACHE_DIR] [--pred-cache=DB_FILE] [--store=STORE_FILE] [--instances=STORE_DIR] [--force] [--debug]
+
+Evaluate every (translation system, language) cell of the evaluation matrix.
+In-process replacement for the loop in evaluate_all_languages.sh: each cell is
+broken into translate -> align -> predict -> evaluate steps, independent steps
+run in a process pool, and steps whose outputs are newer than their inputs are skipped.
+LANGS and SYSTEMS are comma separated, e.g., --langs=es,fr --systems=google,bing
+With --cache, cells with unchanged inputs are restored from the cell cache (see cell_cache.py).
+With --pred-cache, single-instance predictions are shared across cells (see prediction_cache.py).
+With --store, each evaluated cell is also recorded in a results store (see results_store.py).
+With --instances, each predicted cell also writes its instances to a columnar store (see instance_store.py).
+"""
+# External imports
+import logging
+import pdb
+import os
+import json
+import shutil
+import subprocess
+from pprint import pprint
+from pprint import pformat
+from docopt import docopt
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from typing import List, Dict
+
+# Local imports
+from load_alignments import LANGAUGE_PREDICTOR, load_dataset, evaluate_bitext
+from evaluate import evaluate_bias, read_predictions
+from cell_cache import CellCache
+from prediction_cache import PredictionCache, CachedPredictor
+from languages.lru_cache import log_cache_stats
+from alignment_store import AlignmentStore, FAST_ALIGN_PARAMS, DEFAULT_STORE
+from results_store import ResultsStore, system_name
+from instance_store import InstanceStore
+from functools import partial
+#=-----
+
+LANGS = ["ar", "uk", "he", "ru", "it", "fr", "es", "de"]
+MT_SYSTEMS = ["sota", "aws", "bing", "google", "systran"]
+
+# Systems which only cover some of the languages
+SYSTEM_LANGS = {
+    "sota": ["de", "fr"],
+}
+
+# Cells with no translations
+SKIPPED_CELLS = [("aws", "uk")]
+
+# Predictors loaded in the current worker process, by (language, prediction cache)
+_PREDICTORS = {}
+
+
+def should_skip(trans_sys: str, lang: str) -> bool:
+    """
+    Check if a cell is excluded from the matrix.
+    """
+    if (trans_sys, lang) in SKIPPED_CELLS:
+        return True
+    if (trans_sys in SYSTEM_LANGS) and (lang not in SYSTEM_LANGS[trans_sys]):
+        return True
+    return False
+
+def get_predictor(lang: str, pred_cache_fn: str = None):
+    """
+    Return the gender predictor for the given language,
+    loading it at most once per process.
+    With pred_cache_fn, wrap it with the shared prediction cache.
+    """
+    if (lang, pred_cache_fn) not in _PREDICTORS:
+        logging.info(f"Loading {lang} predictor in process {os.getpid()}")
+        gender_predictor = LANGAUGE_PREDICTOR[lang]()
+        if pred_cache_fn is not None:
+            gender_predictor = CachedPredictor(gender_predictor, PredictionCache(pred_cache_fn), lang)
+        _PREDICTORS[(lang, pred_cache_fn)] = gender_predictor
+    return _PREDICTORS[(lang, pred_cache_fn)]
+
+def is_up_to_date(targets: List[str], deps: List[str]) -> bool:
+    """
+    Make-style check: all targets exist and are newer than all dependencies.
+    """
+    if not all(os.path.exists(target) for target in targets):
+        return False
+    if not deps:
+        return True
+    oldest_target = min(os.path.getmtime(target) for target in targets)
+    newest_dep = max(os.path.getmtime(dep) for dep in deps)
+    return oldest_target >= newest_dep
+
+
+class Step:
+    """
+    A single node in the evaluation graph.
+    """
+    def __init__(self, name: str, func, args: tuple, targets: List[str],
+                 deps: List[str], after: List[str]):
+        """
+        func(*args) builds targets from deps, after all steps in `after` are done.
+        """
+        self.name = name
+        self.func = func
+        self.args = args
+        self.targets = targets
+        self.deps = deps
+        self.after = after
+
+
+def translate_step(trans_sys: str, lang: str, sents_fn: str, trans_fn: str):
+    """
+    Translate the English sentences with the given system.
+    """
+    Path(trans_fn).parent.mkdir(parents = True, exist_ok = True)
+    subprocess.run(["python", "translate.py",
+                    f"--trans={trans_sys}", f"--in={sents_fn}",
+                    "--src=en", f"--tgt={lang}", f"--out={trans_fn}"],
+                   check = True)
+
+def align_step(trans_fn: str, align_fn: str):
+    """
+    Align a bitext with fast_align, reusing the alignment store.
+    """
+    shutil.copyfile(AlignmentStore(DEFAULT_STORE).get(trans_fn), align_fn)
+
+def predict_step(lang: str, ds_fn: str, trans_fn: str, align_fn: str, pred_fn: str,
+                 cache_dir: str = None, pred_cache_fn: str = None, instances_dir: str = None) -> Dict:
+    """
+    Predict genders for a cell and write them to pred_fn,
+    and to the instance store, if given.
+    Return the cell's metrics.
+    """
+    Path(pred_fn).parent.mkdir(parents = True, exist_ok = True)
+    ds = load_dataset(ds_fn)
+    gender_predictor = get_predictor(lang, pred_cache_fn)
+    instances_out = None
+    if instances_dir is not None:
+        instances_out = partial(InstanceStore(instances_dir).put, lang, system_name(trans_fn),
+                                ds_fn, trans_fn)
+    metrics = evaluate_bitext(gender_predictor, ds, trans_fn, align_fn, pred_fn,
+                              instances_out = instances_out)
+    log_cache_stats(gender_predictor)
+    if cache_dir is not None:
+        cache = CellCache(cache_dir)
+        cache.put(cache.key(ds_fn, trans_fn, lang, " ".join(FAST_ALIGN_PARAMS)),
+                  pred_fn, metrics)
+    return metrics
+
+def evaluate_step(ds_fn: str, pred_fn: str, metrics_fn: str,
+                  store_fn: str = None, trans_sys: str = None, lang: str = None) -> Dict:
+    """
+    Compute bias metrics from a predictions file and write them to metrics_fn,
+    and to the results store, if given.
+    """
+    ds = load_dataset(ds_fn)
+    output_dict = evaluate_bias(ds, read_predictions(pred_fn))
+    with open(metrics_fn, "w", encoding = "utf8") as fout:
+        fout.write(json.dumps(output_dict) + "\n")
+    if store_fn is not None:
+        ResultsStore(store_fn).add(trans_sys, lang, ds_fn, "all", output_dict)
+    return output_dict
+
+
+def build_graph(ds_fn: str, out_folder: str, sents_fn: str,
+                trans_systems: List[str], langs: List[str],
+                cache_dir: str = None, pred_cache_fn: str = None,
+                store_fn: str = None, instances_dir: str = None,
+                force: bool = False) -> Dict[str, Step]:
+    """
+    Build the translate -> align -> predict -> evaluate graph for all
+    non-skipped cells.
+    Cells found in the cache only get an evaluate step
+    (unless their instances are missing from the instance store, or force is set).
+    """
+    cache = CellCache(cache_dir) if cache_dir is not None else None
+    instance_store = InstanceStore(instances_dir) if instances_dir is not None else None
+    steps = {}
+    for trans_sys in trans_systems:
+        for lang in langs:
+            if should_skip(trans_sys, lang):
+                logging.info(f"skipping {trans_sys}, {lang}")
+                continue
+
+            prefix = f"en-{lang}"
+            cell = f"{trans_sys}/{lang}"
+            sys_folder = f"{out_folder}/{trans_sys}"
+            trans_fn = f"../translations/{trans_sys}/{prefix}.txt"
+            align_fn = f"{sys_folder}/forward.{prefix}.align"
+            pred_fn = f"../data/human/{trans_sys}/{lang}/{lang}.pred.csv"
+            metrics_fn = f"{sys_folder}/{lang}.log"
+
+            if (cache is not None) and (not force) and os.path.exists(trans_fn) and \
+               ((instance_store is None) or instance_store.has(lang, trans_sys, ds_fn, trans_fn)):
+                Path(pred_fn).parent.mkdir(parents = True, exist_ok = True)
+                cache_key = cache.key(ds_fn, trans_fn, lang, " ".join(FAST_ALIGN_PARAMS))
+                if cache.restore(cache_key, pred_fn) is not None:
+                    logging.info(f"found cached predictions for {cell}")
+                    steps[f"evaluate:{cell}"] = Step(f"evaluate:{cell}", evaluate_step,
+                                                     (ds_fn, pred_fn, metrics_fn, store_fn, trans_sys, lang),
+                                                     [metrics_fn], [ds_fn, pred_fn], [])
+                    continue
+
+            # Translations are never redone once they exist
+            steps[f"translate:{cell}"] = Step(f"translate:{cell}", translate_step,
+                                              (trans_sys, lang, sents_fn, trans_fn),
+                                              [trans_fn], [], [])
+            steps[f"align:{cell}"] = Step(f"align:{cell}", align_step,
+                                          (trans_fn, align_fn),
+                                          [align_fn], [trans_fn],
+                                          [f"translate:{cell}"])
+            steps[f"predict:{cell}"] = Step(f"predict:{cell}", predict_step,
+                                            (lang, ds_fn, trans_fn, align_fn, pred_fn, cache_dir, pred_cache_fn,
+                                             instances_dir),
+                                            [pred_fn], [ds_fn, trans_fn, align_fn],
+                                            [f"align:{cell}"])
+            steps[f"evaluate:{cell}"] = Step(f"evaluate:{cell}", evaluate_step,
+                                             (ds_fn, pred_fn, metrics_fn, store_fn, trans_sys, lang),
+                                             [metrics_fn], [ds_fn, pred_fn],
+                                             [f"predict:{cell}"])
+    return steps
+
+def run_graph(steps: Dict[str, Step], num_workers: int, force: bool):
+    """
+    Run all steps in dependency order, executing independent
+    steps concurrently in a process pool.
+    """
+    done = set()
+    pending = dict(steps)
+    running = {}
+
+    with ProcessPoolExecutor(max_workers = num_workers) as executor:
+        while pending or running:
+            # Schedule everything whose predecessors finished
+            ready = [step for step in pending.values()
+                     if all(prev in done for prev in step.after)]
+            for step in ready:
+                del pending[step.name]
+                if (not force or step.func is translate_step) and \
+                   is_up_to_date(step.targets, step.deps):
+                    logging.info(f"up to date: {step.name}")
+                    done.add(step.name)
+                    continue
+                logging.info(f"running: {step.name}")
+                running[executor.submit(step.func, *step.args)] = step
+
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when = FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                future.result()     # Propagate worker errors
+                logging.info(f"finished: {step.name}")
+                done.add(step.name)
+
+
+if __name__ == "__main__":
+    # Parse command line arguments
+    args = docopt(__doc__)
+    ds_fn = args["--ds"]
+    out_folder = args["--out"]
+    langs = args["--langs"].split(",") if args["--langs"] else LANGS
+    trans_systems = args["--systems"].split(",") if args["--systems"] else MT_SYSTEMS
+    num_workers = int(args["--workers"]) if args["--workers"] else os.cpu_count()
+    cache_dir = args["--cache"]
+    pred_cache_fn = args["--pred-cache"]
+    store_fn = args["--store"]
+    instances_dir = args["--instances"]
+    force = args["--force"]
+    debug = args["--debug"]
+    if debug:
+        logging.basicConfig(level = logging.DEBUG)
+    else:
+        logging.basicConfig(level = logging.INFO)
+
+    # Prepare files for translation
+    for trans_sys in trans_systems:
+        Path(f"{out_folder}/{trans_sys}").mkdir(parents = True, exist_ok = True)
+    sents_fn = f"{out_folder}/tmp.in"
+    with open(sents_fn, "w", encoding = "utf8") as fout:
+        for entry in load_dataset(ds_fn):
+            fout.write(entry[2] + "\n")
+
+    steps = build_graph(ds_fn, out_folder, sents_fn, trans_systems, langs, cache_dir, pred_cache_fn,
+                        store_fn, instances_dir, force)
+    run_graph(steps, num_workers, force)
+
+    logging.info("DONE")
@@ -0,0 +1,126 @@
+""" Usage:
+    <file-name> --lang-fn=LANG_FILE [--out=OUT_FILE] [--store=STORE_FILE] [--wmt=WMT_FOLDER] [--workers=NUM_WORKERS] [--align-store=STORE_DIR] [--cache=CACHE_DIR] [--pred-cache=DB_FILE] [--instances=STORE_DIR] [--debug]
+
+Evaluate all WMT submissions of a language pair in parallel.
+In-process replacement for evaluate_wmt.sh, e.g., --lang-fn=en-de.txt evaluates
+WMT_FOLDER/*/en-de.txt (WMT_FOLDER defaults to ../translations/wmt).
+Systems run concurrently in a pool of NUM_WORKERS processes (default: cpu count).
+Each is aligned and predicted once, and its pro and anti metrics are computed over
+the same predictions. The results are appended to OUT_FILE in evaluate_wmt.sh's
+format, in system order, once all systems are done (see generate_table.py).
+With --store, they are also recorded in a results store (see results_store.py).
+With --instances, each system's instances are written to a columnar store (see instance_store.py).
+"""
+# External imports
+import logging
+import pdb
+import os
+import json
+from pprint import pprint
+from pprint import pformat
+from docopt import docopt
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict
+
+# Local imports
+from load_alignments import load_dataset
+from evaluate import evaluate_subset, read_predictions, subset_mask
+from evaluate_matrix import predict_step
+from cell_cache import CellCache
+from alignment_store import AlignmentStore, DEFAULT_STORE
+from results_store import ResultsStore, make_record
+from instance_store import InstanceStore
+#=-----
+
+WMT_BASE = "../translations/wmt"
+ALL_GOLD = "../data/aggregates/en.txt"
+SUBSETS = [("pro-stereotypical", "../data/aggregates/en_pro.txt"),
+           ("anti-stereotypical", "../data/aggregates/en_anti.txt")]
+RESULT_NAMES = ["all"] + [name for name, _ in SUBSETS]
+
+
+def evaluate_system(system: str, trans_fn: str, lang: str, align_store: str = DEFAULT_STORE,
+                    cache_dir: str = None, pred_cache_fn: str = None, instances_dir: str = None) -> Dict:
+    """
+    Align, predict and evaluate a single submission.
+    Return its metrics on all instances and on each subset.
+    """
+    pred_fn = f"{trans_fn}.pred.csv"
+    metrics = None
+    if (cache_dir is not None) and \
+       ((instances_dir is None) or InstanceStore(instances_dir).has(lang, system, ALL_GOLD, trans_fn)):
+        cache = CellCache(cache_dir)
+        metrics = cache.restore(cache.key(ALL_GOLD, trans_fn, lang), pred_fn)
+    if metrics is None:
+        align_fn = AlignmentStore(align_store).get_csr(trans_fn)
+        metrics = predict_step(lang, ALL_GOLD, trans_fn, align_fn, pred_fn, cache_dir, pred_cache_fn,
+                               instances_dir)
+
+    ds = load_dataset(ALL_GOLD)
+    predicted = read_predictions(pred_fn)
+    result = {"system": system, "all": metrics}
+    for name, subset_fn in SUBSETS:
+        result[name] = evaluate_subset(ds, predicted, subset_mask(ds, subset_fn))
+    return result
+
+def format_result(result: Dict) -> str:
+    """
+    The system's lines in evaluate_wmt.sh's log format.
+    """
+    lines = [result["system"]]
+    for name in RESULT_NAMES:
+        lines.append(f"{name};;;{json.dumps(result[name])}")
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    # Parse command line arguments
+    args = docopt(__doc__)
+    lang_fn = args["--lang-fn"]
+    out_fn = args["--out"]
+    store_fn = args["--store"]
+    wmt_base = args["--wmt"] or WMT_BASE
+    num_workers = int(args["--workers"]) if args["--workers"] else os.cpu_count()
+    align_store = args["--align-store"] or DEFAULT_STORE
+    cache_dir = args["--cache"]
+    pred_cache_fn = args["--pred-cache"]
+    instances_dir = args["--instances"]
+    debug = args["--debug"]
+    if debug:
+        logging.basicConfig(level = logging.DEBUG)
+    else:
+        logging.basicConfig(level = logging.INFO)
+
+    if (out_fn is None) and (store_fn is None):
+        raise ValueError("At least one of --out and --store is required")
+
+    lang = lang_fn.split(".")[0].split("-")[1]
+    systems = [system for system in sorted(os.listdir(wmt_base))
+               if os.path.isfile(os.path.join(wmt_base, system, lang_fn))]
+    logging.info(f"Evaluating {len(systems)} systems for {lang}")
+
+    results = {}
+    with ProcessPoolExecutor(num_workers) as executor:
+        futures = {executor.submit(evaluate_system, system, os.path.join(wmt_base, system, lang_fn),
+                                   lang, align_store, cache_dir, pred_cache_fn, instances_dir): system
+                   for system in systems}
+        for future in as_completed(futures):
+            system = futures[future]
+            try:
+                results[system] = future.result()
+            except Exception:
+                logging.exception(f"Failed evaluating {system}")
+                continue
+            logging.info(f"finished: {system}")
+
+    done_systems = [system for system in systems if system in results]
+    if out_fn is not None:
+        with open(out_fn, "a", encoding = "utf8") as fout:
+            fout.write("".join(format_result(results[system]) for system in done_systems))
+    if store_fn is not None:
+        ResultsStore(store_fn).add_many([make_record(system, lang, ALL_GOLD, name, results[system][name])
+                                         for system in done_systems
+                                         for name in RESULT_NAMES])
+
+    logging.info(f"Evaluated {len(results)} out of {len(systems)} systems")
+    logging.info("DONE")
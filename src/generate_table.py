@@ -1,7 +1,12 @@
 """ Usage:
     <file-name> --in=INPUT_FILE --out=OUTPUT_FILE [--debug]
+    <file-name> --store=STORE_FILE --out=OUTPUT_FILE [--lang=LANG] [--ds=DATASET_FILE] [--debug]
 
 Create a table format with delta-G and delta-S from an output of several systems.
+With --in, read the log of evaluate_wmt.sh (or evaluate_wmt.py).
+With --store, query the latest metrics of each system and language in a results store
+(see results_store.py), optionally of a single language and dataset.
+Metrics of runs which didn't record the all, pro or anti subsets are left empty.
 
 """
 # External imports
@@ -16,32 +21,34 @@ import json
 import pandas as pd
 
 # Local imports
-
+from results_store import ResultsStore
 
 #----
 
-if __name__ == "__main__":
+PRO_SUBSET = "pro-stereotypical"
+ANTI_SUBSET = "anti-stereotypical"
 
-    # Parse command line arguments
-    args = docopt(__doc__)
-    inp_fn = Path(args["--in"]) if args["--in"] else None
-    out_fn = args["--out"]
 
-    # Determine logging level
-    debug = args["--debug"]
-    if debug:
-        logging.basicConfig(level = logging.DEBUG)
-    else:
-        logging.basicConfig(level = logging.INFO)
+def table_row(all_dict, pro_dict, ant_dict):
+    """
+    Accuracy, delta-G and delta-S of a single run,
+    None where their metrics are missing.
+    """
+    acc = delta_g = delta_s = None
+    if all_dict is not None:
+        acc = round(all_dict["acc"], 1)
+        delta_g = round(all_dict["f1_male"] - all_dict["f1_female"], 1)
+    if (pro_dict is not None) and (ant_dict is not None):
+        delta_s = round(pro_dict["acc"] - ant_dict["acc"], 1)
+    return [acc, delta_g, delta_s]
 
-    # Start computation
+def read_log(inp_fn):
+    """
+    Table rows of a log, made of groups of system name, all, pro and anti lines.
+    """
     lines = [line.strip() for line in open(inp_fn, encoding = "utf8")]
     num_of_lines = len(lines)
     line_ind = 0
-    system_names = []
-    accs = []
-    delta_gs = []
-    delta_ss = []
     results = []
 
     while line_ind < num_of_lines:
@@ -57,15 +64,59 @@ if __name__ == "__main__":
         pro_dict = json.loads(pro_line.split(";;;")[1])
         ant_dict = json.loads(ant_line.split(";;;")[1])
 
-        # compute aggregates
-        acc = round(all_dict["acc"], 1)
-        delta_gs = round(all_dict["f1_male"] - all_dict["f1_female"], 1)
-        delta_ss = round(pro_dict["acc"] - ant_dict["acc"], 1)
-        results.append([system_name, acc, delta_gs, delta_ss])
+        results.append([system_name] + table_row(all_dict, pro_dict, ant_dict))
+    return results
+
+def query_store(store_fn, **filters):
+    """
+    Table rows of the latest runs in a results store, one per system,
+    language and dataset. Repeated records (e.g., of reruns) are deduplicated
+    here, keeping the latest of each system, language, dataset and subset.
+    Metrics of subsets which weren't recorded (e.g., the pro and anti subsets
+    of runs from evaluate_language.sh) are left empty.
+    """
+    runs = {}
+    ds_paths = {}
+    for (system, lang, ds, subset), record in ResultsStore(store_fn).latest(**filters).items():
+        runs.setdefault((system, lang, ds), {})[subset] = record["metrics"]
+        ds_paths[ds] = record.get("ds_path", ds)
+
+    results = []
+    for (system, lang, ds), metrics in sorted(runs.items()):
+        missing = [subset for subset in ["all", PRO_SUBSET, ANTI_SUBSET] if subset not in metrics]
+        if missing:
+            logging.info(f"Missing {', '.join(missing)} metrics of {system}, {lang}, {ds_paths[ds]}")
+        acc, delta_g, delta_s = table_row(metrics.get("all"), metrics.get(PRO_SUBSET),
+                                          metrics.get(ANTI_SUBSET))
+        results.append([system, lang, ds_paths[ds], acc, delta_g, delta_s])
+    return results
+
 
+if __name__ == "__main__":
 
-    df = pd.DataFrame(columns = ["Translation System", "acc", "delta-G", "delta-S"],
-                      data = results)
+    # Parse command line arguments
+    args = docopt(__doc__)
+    inp_fn = Path(args["--in"]) if args["--in"] else None
+    store_fn = args["--store"]
+    out_fn = args["--out"]
+    filters = {field: args[f"--{field}"] for field in ["lang", "ds"]
+               if args[f"--{field}"] is not None}
+
+    # Determine logging level
+    debug = args["--debug"]
+    if debug:
+        logging.basicConfig(level = logging.DEBUG)
+    else:
+        logging.basicConfig(level = logging.INFO)
+
+    # Start computation
+    if store_fn:
+        df = pd.DataFrame(columns = ["Translation System", "Language", "Dataset",
+                                     "acc", "delta-G", "delta-S"],
+                          data = query_store(store_fn, **filters))
+    else:
+        df = pd.DataFrame(columns = ["Translation System", "acc", "delta-G", "delta-S"],
+                          data = read_log(inp_fn))
     df.to_csv(out_fn, index = False)
     # End
     logging.info("DONE")
@@ -12,12 +12,20 @@ from operator import itemgetter
 from tqdm import tqdm
 from google.cloud import translate
 import html
+import os
 
 # Local imports
 
 #=-----
 
-GOOGLE_TRANSLATE_CLIENT = translate.Client()
+# GOOGLE_TRANSLATE_ENDPOINT overrides the service's endpoint (e.g., a local stub server
+# for testing, which is sent no credentials)
+if os.environ.get("GOOGLE_TRANSLATE_ENDPOINT"):
+    from google.auth.credentials import AnonymousCredentials
+    GOOGLE_TRANSLATE_CLIENT = translate.Client(credentials = AnonymousCredentials(),
+                                               client_options = {"api_endpoint": os.environ["GOOGLE_TRANSLATE_ENDPOINT"]})
+else:
+    GOOGLE_TRANSLATE_CLIENT = translate.Client()
 
 def google_translate(sents, target_language, source_language = None):
     """
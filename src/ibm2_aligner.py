@@ -0,0 +1,399 @@
+""" Usage:
+    <file-name> --bi=IN_FILE --out=ALIGN_FILE [--iterations=ITERATIONS] [--debug]
+    <file-name> train --bi=IN_FILE... --model=MODEL_FILE [--iterations=ITERATIONS] [--debug]
+    <file-name> decode --model=MODEL_FILE --bi=IN_FILE --out=ALIGN_FILE [--debug]
+
+Align a `src ||| tgt` bitext with a NumPy implementation of fast_align's
+diagonal-favoring IBM Model 2 (same as `fast_align -d -o -v`).
+The output is in fast_align's `i-j` format.
+
+train:  estimate a model once per language pair (optionally on a larger
+        parallel corpus, given as several --bi files) and save it.
+decode: force-align a new bitext with a saved model, without training.
+"""
+# External imports
+import logging
+import pdb
+from pprint import pprint
+from pprint import pformat
+from docopt import docopt
+from collections import defaultdict
+from tqdm import tqdm
+from typing import List, Dict, Tuple
+import numpy as np
+
+# Local imports
+
+#=-----
+
+NULL = 0                # Source side id of the null word
+MISSING_PROB = 1e-9     # Translation probability of unseen pairs
+CHUNK_SIZE = 1 << 22    # Alignment grid cells per vectorized chunk
+
+
+def digamma(x: np.ndarray) -> np.ndarray:
+    """
+    Vectorized digamma for positive inputs: shift x to >= 6 with the
+    recurrence, then use the asymptotic expansion.
+    """
+    x = np.array(x, dtype = np.float64)
+    result = np.zeros_like(x)
+    small = x < 6
+    while small.any():
+        result[small] -= 1 / x[small]
+        x[small] += 1
+        small = x < 6
+    f = 1 / (x * x)
+    result += np.log(x) - 0.5 / x \
+        - f * (1 / 12 - f * (1 / 120 - f * (1 / 252 - f * (1 / 240 - f / 132))))
+    return result
+
+def diagonal_feature(trg_ind: np.ndarray, src_ind: np.ndarray,
+                     trg_len: np.ndarray, src_len: np.ndarray) -> np.ndarray:
+    """
+    fast_align's distance from the diagonal, -|i/m - j/n|.
+    """
+    return -np.abs(src_ind / src_len - trg_ind / trg_len)
+
+def tokenize_bitext(bitext: List[Tuple[str, str]]) -> Tuple[List[List[str]], List[List[str]]]:
+    """
+    Split a bitext into source and target tokens, as fast_align does.
+    """
+    src_sents = [src_sent.split() for src_sent, tgt_sent in bitext]
+    tgt_sents = [tgt_sent.split() for src_sent, tgt_sent in bitext]
+    return src_sents, tgt_sents
+
+
+class AlignmentGrid:
+    """
+    All (target word, source word or null) cells of a range of sentences,
+    flattened to arrays. Cells are grouped by target word, with the null
+    word first and source words in order, as in fast_align's inner loop.
+    """
+    def __init__(self, src_ids: List[np.ndarray], tgt_ids: List[np.ndarray]):
+        src_lens = np.array([len(ids) for ids in src_ids], dtype = np.int64)
+        tgt_lens = np.array([len(ids) for ids in tgt_ids], dtype = np.int64)
+        group_sizes = np.repeat(src_lens + 1, tgt_lens)
+        num_groups = len(group_sizes)
+        self.num_groups = num_groups
+        self.group_starts = np.concatenate([[0], np.cumsum(group_sizes)[:-1]]).astype(np.int64)
+        self.group = np.repeat(np.arange(num_groups), group_sizes)
+
+        # Per target word: sentence, position and lengths
+        group_sent = np.repeat(np.arange(len(tgt_ids)), tgt_lens)
+        sent_group_starts = np.concatenate([[0], np.cumsum(tgt_lens)[:-1]])
+        self.group_sent = group_sent
+        self.trg_ind = np.arange(num_groups) - sent_group_starts[group_sent]
+        self.trg_len = tgt_lens[group_sent]
+        self.src_len = src_lens[group_sent]
+
+        # Per cell: source position (0 is null) and word ids
+        cell_ind = np.arange(len(self.group)) - self.group_starts[self.group]
+        self.src_ind = cell_ind
+        self.is_null = cell_ind == 0
+        # (a trailing dummy id keeps the gathers in range for empty sentences)
+        src_offsets = np.concatenate([[0], np.cumsum(src_lens)[:-1]]).astype(np.int64)
+        tgt_offsets = np.concatenate([[0], np.cumsum(tgt_lens)[:-1]]).astype(np.int64)
+        flat_src = np.concatenate(src_ids + [np.zeros(1, dtype = np.int64)])
+        flat_tgt = np.concatenate(tgt_ids + [np.zeros(1, dtype = np.int64)])
+        cell_sent = group_sent[self.group]
+        src_pos = src_offsets[cell_sent] + np.maximum(cell_ind - 1, 0)
+        self.src_word = np.where(self.is_null, NULL, flat_src[src_pos])
+        self.tgt_word = flat_tgt[tgt_offsets[group_sent] + self.trg_ind][self.group]
+
+        # Diagonal features: the prior uses 1-based target positions,
+        # the empirical expectation uses 0-based ones (as fast_align does)
+        cell_trg_ind = self.trg_ind[self.group]
+        cell_trg_len = self.trg_len[self.group]
+        cell_src_len = self.src_len[self.group]
+        self.prior_feat = diagonal_feature(cell_trg_ind + 1, cell_ind, cell_trg_len, cell_src_len)
+        self.emp_feat = diagonal_feature(cell_trg_ind, cell_ind, cell_trg_len, cell_src_len)
+
+    def prior(self, tension: float, prob_align_null: float) -> np.ndarray:
+        """
+        Alignment prior of every cell.
+        """
+        unnorm = np.where(self.is_null, 0., np.exp(self.prior_feat * tension))
+        z = np.bincount(self.group, weights = unnorm, minlength = self.num_groups)
+        return np.where(self.is_null, prob_align_null,
+                        (1 - prob_align_null) * unnorm / np.where(z[self.group] > 0, z[self.group], 1))
+
+    def posteriors(self, probs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Normalize cell scores per target word.
+        Returns the posteriors and the per target word normalizers.
+        """
+        sums = np.bincount(self.group, weights = probs, minlength = self.num_groups)
+        return probs / sums[self.group], sums
+
+    def viterbi(self, probs: np.ndarray) -> np.ndarray:
+        """
+        Best cell per target word (first one on ties, null included).
+        Returns the source index (0 is null) per target word.
+        """
+        if not self.num_groups:
+            return np.zeros(0, dtype = np.int64)
+        group_max = np.maximum.reduceat(probs, self.group_starts)
+        best_cells = np.flatnonzero(probs == group_max[self.group])
+        _, first = np.unique(self.group[best_cells], return_index = True)
+        return self.src_ind[best_cells[first]]
+
+
+class IBM2Aligner:
+    """
+    fast_align's reparameterized IBM Model 2 (-d -o -v), trained with EM
+    over vectorized alignment grids instead of per-word loops.
+    """
+    def __init__(self, iterations: int = 5, diagonal_tension: float = 4.0,
+                 prob_align_null: float = 0.08, alpha: float = 0.01,
+                 optimize_tension: bool = True):
+        """
+        Defaults follow fast_align's.
+        """
+        self.iterations = iterations
+        self.diagonal_tension = diagonal_tension
+        self.prob_align_null = prob_align_null
+        self.alpha = alpha
+        self.optimize_tension = optimize_tension
+        self.src_vocab = {}
+        self.tgt_vocab = {}
+        self.pair_keys = np.zeros(0, dtype = np.int64)    # Sorted src_id * tgt_vocab_size + tgt_id
+        self.ttable = np.zeros(0, dtype = np.float64)
+
+    def _encode(self, sents: List[List[str]], vocab: Dict[str, int],
+                first_id: int, grow: bool) -> List[np.ndarray]:
+        """
+        Map tokens to ids, optionally growing the vocabulary.
+        Unknown tokens get -1 when the vocabulary is fixed.
+        """
+        encoded = []
+        for sent in sents:
+            ids = []
+            for word in sent:
+                if word not in vocab:
+                    if not grow:
+                        ids.append(-1)
+                        continue
+                    vocab[word] = len(vocab) + first_id
+                ids.append(vocab[word])
+            encoded.append(np.array(ids, dtype = np.int64))
+        return encoded
+
+    def _grids(self, src_ids: List[np.ndarray], tgt_ids: List[np.ndarray]) -> List[Tuple[int, AlignmentGrid]]:
+        """
+        Split sentences into chunks of about CHUNK_SIZE cells.
+        Returns (first sentence index, grid) pairs.
+        """
+        grids = []
+        start = 0
+        cells = 0
+        for ind, (src, tgt) in enumerate(zip(src_ids, tgt_ids)):
+            cells += (len(src) + 1) * len(tgt)
+            if cells >= CHUNK_SIZE:
+                grids.append((start, AlignmentGrid(src_ids[start : ind + 1], tgt_ids[start : ind + 1])))
+                start = ind + 1
+                cells = 0
+        if start < len(src_ids):
+            grids.append((start, AlignmentGrid(src_ids[start:], tgt_ids[start:])))
+        return grids
+
+    def _pair_keys(self, grid: AlignmentGrid) -> np.ndarray:
+        """
+        Combine source and target ids of each cell into one key.
+        """
+        return grid.src_word * (len(self.tgt_vocab) + 1) + grid.tgt_word
+
+    def _lookup(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Translation table index of each key, and whether it was found.
+        """
+        inds = np.searchsorted(self.pair_keys, keys)
+        inds = np.minimum(inds, max(len(self.pair_keys) - 1, 0))
+        found = (self.pair_keys[inds] == keys) if len(self.pair_keys) else np.zeros(len(keys), dtype = bool)
+        return inds, found
+
+    def _mod_feat(self, size_counts: Dict[Tuple[int, int], int], toks: int) -> Tuple[np.ndarray, ...]:
+        """
+        Static arrays for the model expectation of the diagonal feature,
+        one group per (sentence lengths, target position).
+        """
+        feats, groups, weights = [], [], []
+        group_ind = 0
+        for (trg_len, src_len), count in size_counts.items():
+            trg_ind = np.repeat(np.arange(1, trg_len + 1), src_len)
+            src_ind = np.tile(np.arange(1, src_len + 1), trg_len)
+            feats.append(diagonal_feature(trg_ind, src_ind, trg_len, src_len))
+            groups.append(np.repeat(np.arange(group_ind, group_ind + trg_len), src_len))
+            weights.append(np.full(trg_len, count / toks))
+            group_ind += trg_len
+        return np.concatenate(feats), np.concatenate(groups), np.concatenate(weights)
+
+    def _optimize_tension(self, emp_feat: float, mod_arrays):
+        """
+        fast_align's gradient steps on the diagonal tension.
+        """
+        feat, group, weight = mod_arrays
+        for _ in range(8):
+            unnorm = np.exp(feat * self.diagonal_tension)
+            z = np.bincount(group, weights = unnorm, minlength = len(weight))
+            dlogz = np.bincount(group, weights = unnorm * feat, minlength = len(weight)) / z
+            mod_feat = (weight * dlogz).sum()
+            self.diagonal_tension += (emp_feat - mod_feat) * 20.0
+            self.diagonal_tension = min(max(self.diagonal_tension, 0.1), 14)
+
+    def fit(self, bitext: List[Tuple[str, str]]):
+        """
+        Train translation probabilities and diagonal tension with EM.
+        As in fast_align, the last iteration is reserved for decoding.
+        """
+        src_sents, tgt_sents = tokenize_bitext(bitext)
+        src_ids = self._encode(src_sents, self.src_vocab, NULL + 1, grow = True)
+        tgt_ids = self._encode(tgt_sents, self.tgt_vocab, 0, grow = True)
+        grids = self._grids(src_ids, tgt_ids)
+
+        # Translation table over all co-occurring pairs, uniform to start with
+        self.pair_keys = np.unique(np.concatenate([np.zeros(0, dtype = np.int64)] +
+                                                  [self._pair_keys(grid) for _, grid in grids]))
+        self.ttable = np.ones(len(self.pair_keys))
+        pair_inds = [self._lookup(self._pair_keys(grid))[0] for _, grid in grids]
+        pair_src = self.pair_keys // (len(self.tgt_vocab) + 1)
+
+        toks = sum(len(tgt) for tgt in tgt_ids)
+        size_counts = defaultdict(int)
+        for src, tgt in zip(src_ids, tgt_ids):
+            if len(src) and len(tgt):
+                size_counts[(len(tgt), len(src))] += 1
+        mod_arrays = self._mod_feat(size_counts, max(toks, 1)) if size_counts else None
+
+        for iteration in tqdm(range(self.iterations - 1), desc = "EM iterations"):
+            counts = np.zeros(len(self.pair_keys))
+            emp_feat = 0.
+            likelihood = 0.
+            for (_, grid), inds in zip(grids, pair_inds):
+                probs = self.ttable[inds] * grid.prior(self.diagonal_tension, self.prob_align_null)
+                post, sums = grid.posteriors(probs)
+                counts += np.bincount(inds, weights = post, minlength = len(self.pair_keys))
+                emp_feat += (grid.emp_feat * post)[~grid.is_null].sum()
+                likelihood += np.log(sums).sum()
+            logging.debug(f"iteration {iteration}: log likelihood = {likelihood}, "
+                          f"tension = {self.diagonal_tension}")
+
+            if self.optimize_tension and (iteration > 0) and (mod_arrays is not None):
+                self._optimize_tension(emp_feat / toks, mod_arrays)
+
+            # Variational Bayes normalization, per source word
+            tot = np.bincount(pair_src, weights = counts + self.alpha)
+            self.ttable = np.exp(digamma(counts + self.alpha) - digamma(tot[pair_src]))
+        return self
+
+    def save(self, model_fn: str):
+        """
+        Save the trained parameters in .npz format, to exactly model_fn
+        (np.savez would add an .npz suffix to a file name).
+        """
+        src_words = sorted(self.src_vocab, key = self.src_vocab.get)
+        tgt_words = sorted(self.tgt_vocab, key = self.tgt_vocab.get)
+        with open(model_fn, "wb") as fout:
+            np.savez(fout,
+                     src_words = np.array(src_words, dtype = str),
+                     tgt_words = np.array(tgt_words, dtype = str),
+                     pair_keys = self.pair_keys,
+                     ttable = self.ttable,
+                     params = np.array([self.diagonal_tension, self.prob_align_null, self.alpha]))
+
+    @classmethod
+    def load(cls, model_fn: str):
+        """
+        Load parameters saved with save(), ready for decoding.
+        """
+        with np.load(model_fn) as model:
+            diagonal_tension, prob_align_null, alpha = model["params"].tolist()
+            aligner = cls(diagonal_tension = diagonal_tension,
+                          prob_align_null = prob_align_null, alpha = alpha)
+            aligner.src_vocab = {word: ind + NULL + 1
+                                 for ind, word in enumerate(model["src_words"].tolist())}
+            aligner.tgt_vocab = {word: ind
+                                 for ind, word in enumerate(model["tgt_words"].tolist())}
+            aligner.pair_keys = model["pair_keys"]
+            aligner.ttable = model["ttable"]
+        return aligner
+
+    def align(self, bitext: List[Tuple[str, str]]) -> List[Dict[int, List[int]]]:
+        """
+        Viterbi alignments with the current parameters (a single decoding
+        pass, no training). Words unseen in training get a tiny translation
+        probability, so their alignment falls back to the diagonal prior.
+        Returns one {source index: [target indices]} dict per line.
+        """
+        src_sents, tgt_sents = tokenize_bitext(bitext)
+        src_ids = self._encode(src_sents, self.src_vocab, NULL + 1, grow = False)
+        tgt_ids = self._encode(tgt_sents, self.tgt_vocab, 0, grow = False)
+
+        alignments = [defaultdict(list) for _ in bitext]
+        for start, grid in self._grids(src_ids, tgt_ids):
+            inds, found = self._lookup(self._pair_keys(grid))
+            unknown = (grid.src_word < 0) | (grid.tgt_word < 0) | ~found
+            ttable = np.where(unknown, MISSING_PROB, self.ttable[inds] if len(self.ttable) else MISSING_PROB)
+            probs = ttable * grid.prior(self.diagonal_tension, self.prob_align_null)
+            best = grid.viterbi(probs)
+            for sent_ind, trg_ind, src_ind in zip(grid.group_sent.tolist(),
+                                                  grid.trg_ind.tolist(),
+                                                  best.tolist()):
+                if src_ind > 0:
+                    alignments[start + sent_ind][src_ind - 1].append(trg_ind)
+        return alignments
+
+
+def align_bitext(bitext: List[Tuple[str, str]], model_fn: str = None, **kwargs) -> List[Dict[int, List[int]]]:
+    """
+    Return the alignments of a bitext. Decode with a saved model if model_fn
+    is given, otherwise train on the bitext itself, like a single fast_align run.
+    """
+    if model_fn is not None:
+        return IBM2Aligner.load(model_fn).align(bitext)
+    return IBM2Aligner(**kwargs).fit(bitext).align(bitext)
+
+def read_bitext(bi_fn: str) -> List[List[str]]:
+    """
+    Read a `src ||| tgt` file.
+    """
+    return [line.rstrip("\n").split(" ||| ") for line in open(bi_fn, encoding = "utf8")]
+
+def format_alignment(alignment: Dict[int, List[int]]) -> str:
+    """
+    Format a single line's alignment in fast_align's `i-j` format,
+    ordered by target index.
+    """
+    links = sorted((tgt_ind, src_ind) for src_ind, tgt_inds in alignment.items()
+                   for tgt_ind in tgt_inds)
+    return " ".join(f"{src_ind}-{tgt_ind}" for tgt_ind, src_ind in links)
+
+
+if __name__ == "__main__":
+    # Parse command line arguments
+    args = docopt(__doc__)
+    bi_fns = args["--bi"]
+    out_fn = args["--out"]
+    model_fn = args["--model"]
+    iterations = int(args["--iterations"]) if args["--iterations"] else 5
+    debug = args["--debug"]
+    if debug:
+        logging.basicConfig(level = logging.DEBUG)
+    else:
+        logging.basicConfig(level = logging.INFO)
+
+    bitext = [pair for bi_fn in bi_fns for pair in read_bitext(bi_fn)]
+
+    if args["train"]:
+        IBM2Aligner(iterations = iterations).fit(bitext).save(model_fn)
+        logging.info(f"Saved model to {model_fn}")
+    else:
+        if args["decode"]:
+            alignments = align_bitext(bitext, model_fn = model_fn)
+        else:
+            alignments = align_bitext(bitext, iterations = iterations)
+        with open(out_fn, "w", encoding = "utf8") as fout:
+            for alignment in alignments:
+                fout.write(format_alignment(alignment) + "\n")
+
+    logging.info("DONE")
@@ -0,0 +1,172 @@
+""" Usage:
+    <file-name> --store=STORE_DIR --lang=LANG --systems=SYSTEMS [--ds=DATASET_FILE] [--out=OUT_FILE] [--debug]
+
+Compare the per-instance predictions of two or more translation systems
+(comma separated, e.g., --systems=google,bing) for a single language.
+Print, for each source profession, on how many instances the systems disagree
+on the predicted gender, most flipped first (to OUT_FILE as csv, if given).
+
+The store is a folder of Parquet files partitioned by language and system
+(STORE_DIR/lang=LANG/system=SYSTEM/), with one row per dataset instance
+and genders as integer codes (see languages.util.GENDER).
+Requires pyarrow.
+"""
+# External imports
+import logging
+import pdb
+import os
+import tempfile
+from pprint import pprint
+from pprint import pformat
+from docopt import docopt
+from pathlib import Path
+from typing import Dict, List
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.dataset as pds
+except ImportError:
+    pa = None
+
+# Local imports
+from languages.util import GENDER
+from alignment_store import file_hash
+#=-----
+
+def instance_schema():
+    return pa.schema([("ds", pa.dictionary(pa.int32(), pa.string())),
+                      ("ds_path", pa.dictionary(pa.int32(), pa.string())),
+                      ("instance", pa.int32()),
+                      ("gold_gender", pa.int8()),
+                      ("src_index", pa.int32()),
+                      ("profession", pa.dictionary(pa.int32(), pa.string())),
+                      ("translated_profession", pa.string()),
+                      ("tgt_indices", pa.list_(pa.int32())),
+                      ("predicted_gender", pa.int8())])
+
+
+class InstanceStore:
+    """
+    Columnar store of per-instance predictions across systems and languages.
+    Each (language, system, dataset) cell is a single Parquet file, named by the
+    content of the dataset and of the bitext its predictions came from.
+    It's written to a temporary file and renamed into place, so readers never
+    see partial files, and the cell's files from other bitexts (e.g., before
+    a re-translation) are then removed.
+    """
+    def __init__(self, store_dir: str):
+        if pa is None:
+            raise ImportError("The instance store requires pyarrow (pip install pyarrow)")
+        self.store_dir = store_dir
+
+    def path(self, lang: str, system: str, ds_fn: str, bi_fn: str) -> str:
+        """
+        The cell's file, named by the dataset's and the bitext's content.
+        """
+        return os.path.join(self.store_dir, f"lang={lang}", f"system={system}",
+                            f"{file_hash(ds_fn)[:16]}-{file_hash(bi_fn)[:16]}.parquet")
+
+    def put(self, lang: str, system: str, ds_fn: str, bi_fn: str, ds: List[List[str]],
+            translated_profs: List[str], tgt_inds: List[List[int]],
+            gender_predictions: List[GENDER]):
+        """
+        Store a cell's instances. The ds column holds the dataset's content hash
+        (as in results_store.py), and ds_path its path, for display only.
+        """
+        table = pa.table({"ds": [file_hash(ds_fn)] * len(ds),
+                          "ds_path": [os.path.abspath(ds_fn)] * len(ds),
+                          "instance": range(len(ds)),
+                          "gold_gender": [GENDER[entry[0]].value for entry in ds],
+                          "src_index": [int(entry[1]) for entry in ds],
+                          "profession": [entry[3] for entry in ds],
+                          "translated_profession": translated_profs,
+                          "tgt_indices": tgt_inds,
+                          "predicted_gender": [gender.value for gender in gender_predictions]},
+                         schema = instance_schema())
+        out_fn = self.path(lang, system, ds_fn, bi_fn)
+        cell_dir = os.path.dirname(out_fn)
+        Path(cell_dir).mkdir(parents = True, exist_ok = True)
+        # Dot files are ignored by readers
+        fd, tmp_fn = tempfile.mkstemp(dir = cell_dir, prefix = ".")
+        os.close(fd)
+        pq.write_table(table, tmp_fn)
+        os.replace(tmp_fn, out_fn)
+        # Instances of the dataset from previous translations
+        ds_prefix = os.path.basename(out_fn).split("-")[0] + "-"
+        for fn in os.listdir(cell_dir):
+            if fn.startswith(ds_prefix) and (fn != os.path.basename(out_fn)):
+                os.remove(os.path.join(cell_dir, fn))
+
+    def has(self, lang: str, system: str, ds_fn: str, bi_fn: str) -> bool:
+        """
+        Check if the cell's instances are stored for this version of the bitext.
+        """
+        return os.path.exists(self.path(lang, system, ds_fn, bi_fn))
+
+    def dataset(self):
+        """
+        All cells as a single dataset, with lang and system columns.
+        """
+        return pds.dataset(self.store_dir, format = "parquet", partitioning = "hive")
+
+    def load(self, columns: List[str] = None, **filters) -> "pa.Table":
+        """
+        Read the given columns of the rows whose fields match the given
+        filters (e.g., lang = "de", system = ["google", "bing"]).
+        A ds filter is a dataset file, matched by content, as in the results store.
+        """
+        if "ds" in filters:
+            filters["ds"] = file_hash(filters["ds"])
+        expression = None
+        for field, value in filters.items():
+            if isinstance(value, list):
+                cond = pds.field(field).isin(value)
+            else:
+                cond = pds.field(field) == value
+            expression = cond if expression is None else expression & cond
+        return self.dataset().to_table(columns = columns, filter = expression)
+
+
+def gender_flips(store: InstanceStore, lang: str, systems: List[str], ds_fn: str = None):
+    """
+    Per source profession, the number of instances on which
+    the systems predict different genders.
+    """
+    filters = {"lang": lang, "system": systems}
+    if ds_fn is not None:
+        filters["ds"] = ds_fn
+    df = store.load(columns = ["system", "ds", "instance", "profession", "predicted_gender"],
+                    **filters).to_pandas()
+    by_system = df.pivot_table(index = ["ds", "instance", "profession"], columns = "system",
+                               values = "predicted_gender", observed = True)
+    by_system = by_system.dropna()
+    flipped = by_system.nunique(axis = 1) > 1
+    counts = by_system.assign(flipped = flipped).groupby(level = "profession", observed = True)["flipped"]
+    return counts.agg(["sum", "count"]) \
+                 .rename(columns = {"sum": "flipped", "count": "instances"}) \
+                 .astype(int) \
+                 .sort_values("flipped", ascending = False)
+
+
+if __name__ == "__main__":
+    # Parse command line arguments
+    args = docopt(__doc__)
+    store_dir = args["--store"]
+    lang = args["--lang"]
+    systems = args["--systems"].split(",")
+    ds_fn = args["--ds"]
+    out_fn = args["--out"]
+    debug = args["--debug"]
+    if debug:
+        logging.basicConfig(level = logging.DEBUG)
+    else:
+        logging.basicConfig(level = logging.INFO)
+
+    flips = gender_flips(InstanceStore(store_dir), lang, systems, ds_fn)
+    if out_fn:
+        flips.to_csv(out_fn)
+    else:
+        print(flips.to_string())
+
+    logging.info("DONE")
@@ -4,44 +4,291 @@
 # External imports
 import logging
 import pdb
+import os
+import json
+import fcntl
+import atexit
+import hashlib
+import tempfile
 from docopt import docopt
 from collections import Counter
+from multiprocessing import Pool
+from tqdm import tqdm
 from ufal.morphodita import *
+from typing import Dict, List, Tuple
 import re
 
 # Local imports
 from languages.util import GENDER, get_gender_from_token
+from languages.variant_matcher import VariantMatcher
+from languages.lru_cache import LRUCache
 #=-----
 
-class CzechPredictor:
+TAGGER_FN = '../czech-morfflex-pdt-161115/czech-morfflex-pdt-161115.tagger'
+# Persisted tags, one file per tagger model (cache/morphodita at the repository's root)
+TAG_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "cache", "morphodita")
+TAG_FLUSH_SIZE = 1000                   # Tagged sentences buffered before appending them
+N_PROCESS = 1                           # Tagging processes used by get_genders
+
+
+class MorphoditaTagger:
     """
-    Class for Czech language.
+    Morphodita tagger with its own tokenizer and buffers,
+    so each process can tag independently.
     """
-    def __init__(self):
-        self.tagger = Tagger.load('../czech-morfflex-pdt-161115/czech-morfflex-pdt-161115.tagger')
+    def __init__(self, tagger_fn: str = TAGGER_FN):
+        self.tagger = Tagger.load(tagger_fn)
 
         self.tokenizer = self.tagger.newTokenizer()
         self.forms = Forms()
         self.lemmas = TaggedLemmas()
         self.tokens = TokenRanges()
-    
+
+    def tag(self, text: str) -> List[Tuple[str, str]]:
+        """
+        Return (substring, tag) of the nouns in the first sentence of text.
+        Only nouns are kept, as other tokens are never used for prediction.
+        """
+        self.tokenizer.setText(text)
+        self.tokenizer.nextSentence(self.forms, self.tokens)
+        self.tagger.tag(self.forms, self.lemmas)
+
+        nouns = []
+        for i in range(len(self.lemmas)):
+            tag = self.lemmas[i].tag # this has a form NNFS1-----A---- where third letter specifies gender
+            if tag[0] != 'N' or tag[1] != 'N':
+                continue
+            token = self.tokens[i]
+            nouns.append((text[token.start : token.start + token.length], tag))
+        return nouns
+
+
+# Tagger of each worker process in the tagging pool
+_worker_tagger = None
+
+def _init_worker(tagger_fn: str):
+    global _worker_tagger
+    _worker_tagger = MorphoditaTagger(tagger_fn)
+
+def _tag_in_worker(text: str) -> List[Tuple[str, str]]:
+    return _worker_tagger.tag(text)
+
+
+class CzechPredictor:
+    """
+    Class for Czech language.
+    """
+    def __init__(self, n_process: int = N_PROCESS, tagger_fn: str = TAGGER_FN,
+                 tag_cache_dir: str = TAG_CACHE_DIR):
+        """
+        Tags are cached per sentence hash, and persisted under tag_cache_dir
+        (pass None to keep them in memory only), once per sentence:
+        appended per batch, or every TAG_FLUSH_SIZE sentences tagged one by one.
+        The tagger itself is only loaded once a sentence needs tagging.
+        """
+        self.n_process = n_process
+        self.tagger_fn = tagger_fn
+        self.tagger = None
+        self.tag_cache = LRUCache()    # Sentence hash -> nouns tags
+        self.persisted_keys = set()    # Sentence hashes in the cache file
+        self.unflushed_tags = {}       # Tags to append to the cache file
+
+        self.tag_cache_fn = None
+        if tag_cache_dir is not None:
+            os.makedirs(tag_cache_dir, exist_ok = True)
+            model_name = os.path.splitext(os.path.basename(tagger_fn))[0]
+            self.tag_cache_fn = os.path.join(tag_cache_dir, f"{model_name}.jsonl")
+            self.load_tag_cache()
+            atexit.register(self.flush_tags)
+
+        # male form sometimes is prefix for female form "lékař" "lékařka"
+        self.variant_matcher = VariantMatcher(self.variants, "[^a-z]")
+        self.common_error_patterns = {prof: re.compile("|".join(map(re.escape, forms)))
+                                      for prof, forms in self.common_errors.items()}
+
+    @staticmethod
+    def sentence_key(text: str) -> str:
+        return hashlib.sha1(text.encode("utf8")).hexdigest()
+
+    def load_tag_cache(self):
+        """
+        Read persisted tags, and compact the file if it holds
+        duplicate or malformed (e.g., partially written) lines.
+        """
+        if not os.path.exists(self.tag_cache_fn):
+            return
+        with open(self.tag_cache_fn, "r+", encoding = "utf8") as fin:
+            fcntl.flock(fin, fcntl.LOCK_EX)
+            try:
+                entries = {}
+                num_lines = 0
+                for line in fin:
+                    num_lines += 1
+                    try:
+                        key, nouns = json.loads(line)
+                    except ValueError:
+                        continue
+                    entries[key] = [tuple(noun) for noun in nouns]
+                if len(entries) < num_lines:
+                    self.rewrite_tag_cache(entries)
+            finally:
+                fcntl.flock(fin, fcntl.LOCK_UN)
+        self.persisted_keys = set(entries)
+        self.tag_cache.update(entries)
+        logging.debug(f"Loaded {len(entries)} tagged sentences from {self.tag_cache_fn}")
+
+    def rewrite_tag_cache(self, entries: Dict[str, List[Tuple[str, str]]]):
+        """
+        Replace the cache file with one line per entry.
+        Appends which wait for the lock meanwhile are lost,
+        and their sentences just get tagged again.
+        """
+        logging.info(f"Compacting {self.tag_cache_fn} to {len(entries)} tagged sentences")
+        fd, tmp_fn = tempfile.mkstemp(dir = os.path.dirname(self.tag_cache_fn), suffix = ".tmp")
+        with os.fdopen(fd, "w", encoding = "utf8") as fout:
+            for key, nouns in entries.items():
+                fout.write(json.dumps([key, nouns], ensure_ascii = False) + "\n")
+        os.replace(tmp_fn, self.tag_cache_fn)
+
+    def store_tags(self, new_tags: Dict[str, List[Tuple[str, str]]]):
+        """
+        Add tagged sentences to the cache, and buffer those which
+        aren't persisted yet (see flush_tags).
+        """
+        self.tag_cache.update(new_tags)
+        if self.tag_cache_fn is None:
+            return
+        self.unflushed_tags.update((key, nouns) for key, nouns in new_tags.items()
+                                   if key not in self.persisted_keys)
+        if len(self.unflushed_tags) >= TAG_FLUSH_SIZE:
+            self.flush_tags()
+
+    def flush_tags(self):
+        """
+        Append the buffered tags to the cache file in a single write
+        under an exclusive lock, so concurrent worker processes never
+        interleave their lines.
+        """
+        if (self.tag_cache_fn is None) or (not self.unflushed_tags):
+            return
+        data = "".join(json.dumps([key, nouns], ensure_ascii = False) + "\n"
+                       for key, nouns in self.unflushed_tags.items())
+        with open(self.tag_cache_fn, "a", encoding = "utf8") as fout:
+            fcntl.flock(fout, fcntl.LOCK_EX)
+            try:
+                fout.write(data)
+                fout.flush()
+            finally:
+                fcntl.flock(fout, fcntl.LOCK_UN)
+        self.persisted_keys.update(self.unflushed_tags)
+        self.unflushed_tags = {}
+
+    def get_tags(self, text: str) -> List[Tuple[str, str]]:
+        """
+        Nouns tags of a sentence, tagging it on a cache miss.
+        """
+        key = self.sentence_key(text)
+        nouns = self.tag_cache.get(key)
+        if nouns is None:
+            if self.tagger is None:
+                self.tagger = MorphoditaTagger(self.tagger_fn)
+            nouns = self.tagger.tag(text)
+            self.store_tags({key: nouns})
+        return nouns
+
+    def tag_sentences(self, texts: List[str]):
+        """
+        Tag all uncached sentences, in a pool of n_process workers
+        (each with its own tagger) when n_process > 1.
+        """
+        to_tag = {}
+        for text in texts:
+            key = self.sentence_key(text)
+            if key not in self.tag_cache:
+                to_tag[key] = text
+        if not to_tag:
+            return
+
+        keys = list(to_tag)
+        texts = [to_tag[key] for key in keys]
+        if self.n_process > 1:
+            with Pool(self.n_process, initializer = _init_worker, initargs = (self.tagger_fn,)) as pool:
+                tags = list(tqdm(pool.imap(_tag_in_worker, texts, chunksize = 64),
+                                 total = len(texts), desc = "tagging"))
+        else:
+            if self.tagger is None:
+                self.tagger = MorphoditaTagger(self.tagger_fn)
+            tags = [self.tagger.tag(text) for text in tqdm(texts, desc = "tagging")]
+
+        self.store_tags(dict(zip(keys, tags)))
+        self.flush_tags()
+
     def get_gender(self, profession: str, translated_sent = None, entity_index = None, ds_entry = None) -> GENDER:
         """
         Predict gender of an input profession.
         """
-        correct_prof = ds_entry[3].lower()
-        if ds_entry[0] == "neutral" or "someone" in correct_prof or "child" in correct_prof or "advisee" in correct_prof or "guest" in correct_prof or "mover" in correct_prof or "victim" in correct_prof: 
-            # neutral form is not common in Czech (only for words such as child)
-            # someone and child cannot be in male nor female form
-            # advisee cannot be exactly translated
-            # guest, mover do not have female form
+        if self.is_ignored(ds_entry):
             return GENDER.ignore
 
         gender = self._get_gender(profession, translated_sent, entity_index, ds_entry)
 
         return gender
 
+    def cache_key(self, profession: str, translated_sent = None, entity_index = None, ds_entry = None):
+        """
+        Inputs the prediction depends on, see prediction_cache.py.
+        """
+        return [profession, translated_sent, ds_entry[0], ds_entry[3]]
+
+    def caches(self):
+        """
+        Caches of this predictor, by name.
+        """
+        return {"tags": self.tag_cache}
+
+    def get_genders(self, instances) -> List[GENDER]:
+        """
+        Predict genders for a list of
+        (profession, translated_sent, entity_index, ds_entry) tuples.
+        Sentences which aren't resolved by the manual rules are tagged
+        together, see tag_sentences.
+        """
+        genders = []
+        for profession, translated_sent, entity_index, ds_entry in instances:
+            if self.is_ignored(ds_entry):
+                genders.append(GENDER.ignore)
+            else:
+                genders.append(self._get_gender_by_rules(profession, translated_sent, entity_index, ds_entry))
+
+        pending = [ind for ind, gender in enumerate(genders)
+                   if (gender not in [GENDER.male, GENDER.female, GENDER.neutral, GENDER.ignore])
+                   and instances[ind][0].strip()]
+        self.tag_sentences([instances[ind][1] for ind in pending])
+
+        for ind, (profession, translated_sent, entity_index, ds_entry) in enumerate(instances):
+            if genders[ind] not in [GENDER.male, GENDER.female, GENDER.neutral, GENDER.ignore]:
+                genders[ind] = self._get_gender_automatically(profession, translated_sent, entity_index, ds_entry)
+
+        return genders
+
+    @staticmethod
+    def is_ignored(ds_entry) -> bool:
+        correct_prof = ds_entry[3].lower()
+        # neutral form is not common in Czech (only for words such as child)
+        # someone and child cannot be in male nor female form
+        # advisee cannot be exactly translated
+        # guest, mover do not have female form
+        return ds_entry[0] == "neutral" or "someone" in correct_prof or "child" in correct_prof or "advisee" in correct_prof or "guest" in correct_prof or "mover" in correct_prof or "victim" in correct_prof
+
     def _get_gender(self, profession: str, translated_sent = None, entity_index = None, ds_entry = None) -> GENDER:
+        gender = self._get_gender_by_rules(profession, translated_sent, entity_index, ds_entry)
+
+        if gender in [GENDER.male, GENDER.female, GENDER.neutral]:
+            return gender
+
+        return self._get_gender_automatically(profession, translated_sent, entity_index, ds_entry)
+
+    def _get_gender_by_rules(self, profession: str, translated_sent = None, entity_index = None, ds_entry = None) -> GENDER:
         expected_english_profession = ds_entry[3].lower()
         expected_gender = ds_entry[0]
 
@@ -50,19 +297,15 @@ class CzechPredictor:
 
         # check if translation doesn't contain common mistakes of translating profession as a place where it happens "hairdresser" > "hair saloon"
         if gender == GENDER.unknown:
-            if expected_english_profession in self.common_errors:
-                for form in self.common_errors[expected_english_profession]:
-                     if re.search(form, translated_sent.lower()):
-                         # this is definitelly error, resolve as incorrect label 
-                         if expected_gender == "male":
-                             gender = GENDER.female
-                         else:
-                             gender = GENDER.male
-
-        if gender in [GENDER.male, GENDER.female, GENDER.neutral]:
-            return gender
+            if expected_english_profession in self.common_error_patterns:
+                if self.common_error_patterns[expected_english_profession].search(translated_sent.lower()):
+                    # this is definitelly error, resolve as incorrect label 
+                    if expected_gender == "male":
+                        gender = GENDER.female
+                    else:
+                        gender = GENDER.male
 
-        return self._get_gender_automatically(profession, translated_sent, entity_index, ds_entry)
+        return gender
 
     def _get_gender_manual_rules(self, profession: str, translated_sent = None, entity_index = None, ds_entry = None) -> GENDER:
         # Rules defined and checked by Tom Kocmi
@@ -73,25 +316,19 @@ class CzechPredictor:
 
         found_gender = GENDER.unknown
 
-        male = expected_english_profession + "-male"
-        female = expected_english_profession + "-female"
-        
+        # a single scan finds all male and female forms of the profession
+        hits = self.variant_matcher.match(expected_english_profession, translated_sent)
+
         both_possible = False
-        if male in self.variants:
-            for form in self.variants[male]:
-                if re.search(form + "[^a-z]", translated_sent): # male form sometimes is prefix for female form "lékař" "lékařka"
-                    found_gender = GENDER.male
-                    break
-    
-        if female in self.variants:
-            for form in self.variants[female]:
-                if re.search(form + "[^a-z]", translated_sent):
-                    if found_gender is GENDER.male:
-                        found_gender = GENDER.unknown
-                        both_possible = True
-                        break # the form is equal for both female and male
-                    found_gender = GENDER.female
-                    # do not break, to check if other variants can't resolve in "both possible"
+        if hits.male:
+            found_gender = GENDER.male
+
+        if hits.female:
+            if found_gender is GENDER.male:
+                found_gender = GENDER.unknown
+                both_possible = True # the form is equal for both female and male
+            else:
+                found_gender = GENDER.female
 
         # our morphology analysis cannot analyze whole sentence, therefore if both are possible, mark it as correct
         if both_possible:
@@ -104,34 +341,22 @@ class CzechPredictor:
 
     def _get_gender_automatically(self, profession: str, translated_sent = None, entity_index = None, ds_entry = None) -> GENDER:
         """
-        Predict gender, without using cache
+        Predict gender from the (cached) morphodita tags of the sentence.
         """
         if not profession.strip():
             # Empty string
             return GENDER.unknown
 
-        text = translated_sent
-        self.tokenizer.setText(text)
-        self.tokenizer.nextSentence(self.forms, self.tokens)
-        self.tagger.tag(self.forms, self.lemmas)
-
         observed_genders = []
 
         inanimate_masculine = False
-        for i in range(len(self.lemmas)):
-            tag = self.lemmas[i].tag # this has a form NNFS1-----A---- where third letter specifies gender
+        for substring, tag in self.get_tags(translated_sent):
             gender = tag[2]
-            token = self.tokens[i]
-            
-            substring = text[token.start : token.start + token.length]
 
             if substring not in profession:
                 # morphodita makes its tokenization ... thus skip most tokens in sentence and look only for profession
                 continue
 
-            if tag[0] != 'N' or tag[1] != 'N':
-                continue
-
             if gender == "M":
                 observed_genders.append(GENDER.male)
             elif gender == "F":
@@ -11,10 +11,13 @@ from collections import defaultdict
 from operator import itemgetter
 from tqdm import tqdm
 from collections import Counter
+from typing import List
 import spacy
 
 # Local imports
 from languages.util import GENDER, get_gender_from_token
+from languages.spacy_support import BATCH_SIZE, N_PROCESS
+from languages.lru_cache import LRUCache
 #=-----
 
 DE_DETERMINERS = {"der": GENDER.male, "ein": GENDER.male, "dem": GENDER.male, #"den": GENDER.male, 
@@ -36,16 +39,21 @@ class GenderedArticlePredictor:
     """
     Gendered article predictor, assumes spacy support.
     """
-    def __init__(self, lang, determiner_func, exceptions):
+    def __init__(self, lang, determiner_func, exceptions,
+                 batch_size: int = BATCH_SIZE, n_process: int = N_PROCESS):
         """
         Init spacy for the specified language code.
         """
         self.lang = lang
         self.cache = {}    # Store calculated professions genders
+        self.words_cache = LRUCache()    # Store tokenized sentences and professions
+        self.batch_words = {}            # Tokenized texts of the current get_genders batch
         import pdb
         self.nlp = spacy.load(lang, disable = ["parser", "ner"])
         self.get_determiners = determiner_func
         self.exceptions = exceptions
+        self.batch_size = batch_size
+        self.n_process = n_process
 
     def get_gender(self, profession: str, translated_sent, entity_index, ds_entry) -> GENDER:
         """
@@ -57,8 +65,8 @@ class GenderedArticlePredictor:
             return self.exceptions[src_profession]
         if entity_index == -1:
             return GENDER.male
-        words = [word.text for word in self.nlp(translated_sent)]
-        profession_words = [word.text for word in self.nlp(profession)]
+        words = self.get_words(translated_sent)
+        profession_words = self.get_words(profession)
         if any([word.endswith("in") for word in profession_words]):
             return GENDER.female
         dets = self.get_determiners(words)
@@ -70,6 +78,62 @@ class GenderedArticlePredictor:
         identified_gender = closest_det[2]
         return identified_gender
 
+    def cache_key(self, profession: str, translated_sent, entity_index, ds_entry):
+        """
+        Inputs the prediction depends on, see prediction_cache.py.
+        """
+        return [profession, translated_sent, entity_index, ds_entry[3]]
+
+    def caches(self):
+        """
+        Caches of this predictor, by name.
+        """
+        return {"words": self.words_cache}
+
+    def get_genders(self, instances) -> List[GENDER]:
+        """
+        Predict genders for a list of
+        (profession, translated_sent, entity_index, ds_entry) tuples.
+        All distinct sentences and professions which need tokenization
+        are parsed in a single nlp.pipe pass first, and kept for the batch
+        regardless of the LRU cache's capacity.
+        """
+        texts = []
+        for profession, translated_sent, entity_index, ds_entry in instances:
+            if (ds_entry[3].lower() in self.exceptions) or (entity_index == -1):
+                continue
+            texts.extend([translated_sent, profession])
+        to_parse = []
+        for text in dict.fromkeys(texts):
+            words = self.words_cache.get(text)
+            if words is None:
+                to_parse.append(text)
+            else:
+                self.batch_words[text] = words
+
+        try:
+            docs = self.nlp.pipe(to_parse, batch_size = self.batch_size, n_process = self.n_process)
+            for text, doc in tqdm(zip(to_parse, docs), total = len(to_parse)):
+                words = [word.text for word in doc]
+                self.batch_words[text] = words
+                self.words_cache[text] = words
+            return [self.get_gender(*instance) for instance in instances]
+        finally:
+            self.batch_words = {}
+
+    def get_words(self, text: str) -> List[str]:
+        """
+        Tokenize text with spacy, using the current batch's and the LRU cache.
+        """
+        words = self.batch_words.get(text)
+        if words is not None:
+            return words
+        words = self.words_cache.get(text)
+        if words is None:
+            words = [word.text for word in self.nlp(text)]
+            self.words_cache[text] = words
+        return words
+
 def get_german_determiners(words):
     """
     Get a list of (index, determiner, gender)
@@ -0,0 +1,120 @@
+""" Usage:
+    <file-name> --in=IN_FILE --out=OUT_FILE [--debug]
+"""
+# External imports
+import logging
+import pdb
+from docopt import docopt
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# Local imports
+
+#=-----
+
+CACHE_SIZE = 1 << 20    # Default max. entries per cache
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Bounded mapping which evicts the least recently used entries,
+    and counts hits, misses and evictions.
+    maxsize = None keeps all entries.
+    """
+    def __init__(self, maxsize: Optional[int] = CACHE_SIZE):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __contains__(self, key) -> bool:
+        """
+        Membership test, which doesn't count as a lookup.
+        """
+        return key in self.data
+
+    def get(self, key, default = None):
+        """
+        Look up a key, counting a hit or a miss.
+        """
+        value = self.data.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.data.move_to_end(key)
+        return value
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        self.evict()
+
+    def update(self, items: Dict):
+        for key, value in items.items():
+            self[key] = value
+
+    def resize(self, maxsize: Optional[int]):
+        """
+        Change the max. number of entries, evicting if needed.
+        """
+        self.maxsize = maxsize
+        self.evict()
+
+    def evict(self):
+        if self.maxsize is None:
+            return
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last = False)
+            self.evictions += 1
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {"size": len(self.data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None}
+
+
+def predictor_caches(gender_predictor) -> Dict[str, LRUCache]:
+    """
+    The named caches of a predictor (empty if it doesn't expose any).
+    """
+    if hasattr(gender_predictor, "caches"):
+        return gender_predictor.caches()
+    return {}
+
+def log_cache_stats(gender_predictor):
+    """
+    Report the usage of a predictor's caches, to help sizing them.
+    """
+    for name, cache in predictor_caches(gender_predictor).items():
+        logging.info(f"Cache {name}: {cache.stats()}")
+
+
+if __name__ == "__main__":
+    # Parse command line arguments
+    args = docopt(__doc__)
+    inp_fn = args["--in"]
+    out_fn = args["--out"]
+    debug = args["--debug"]
+    if debug:
+        logging.basicConfig(level = logging.DEBUG)
+    else:
+        logging.basicConfig(level = logging.INFO)
+
+    logging.info("DONE")
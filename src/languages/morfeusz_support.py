@@ -11,6 +11,8 @@ import re
 import json
 
 from languages.util import GENDER, MORFEUSZ_GENDER_TYPES, MORFEUSZ_GENDER_TAG_POSITION, WB_GENDER_TYPES
+from languages.variant_matcher import VariantMatcher
+from languages.lru_cache import LRUCache
 
 
 class MorfeuszPredictor:
@@ -28,11 +30,14 @@ class MorfeuszPredictor:
         """
         import morfeusz2
         self.lang = "pl"
-        self.cache = {}    # Store calculated professions
+        self.cache = LRUCache()    # Store calculated professions
 
         with open(self.pl_variants_fn, 'r') as var_json:
             self.variants = json.load(var_json)
 
+        # don't match when profession is preceded by `mrs.` in Polish `pani`, `panią`
+        self.variant_matcher = VariantMatcher(self.variants, r"\W|$", guards = ("pani ", "panią "))
+
         if spacy.util.is_package('pl_spacy_model_morfeusz_big'):
             self.nlp = spacy.load('pl_spacy_model_morfeusz_big', disable=["parser", "ner"])
         elif spacy.util.is_package('pl_spacy_model_morfeusz'):
@@ -62,6 +67,18 @@ class MorfeuszPredictor:
 
         return gender
 
+    def cache_key(self, profession: str, translated_sent = None, entity_index = None, ds_entry = None):
+        """
+        Inputs the prediction depends on, see prediction_cache.py.
+        """
+        return [profession, translated_sent, ds_entry[0], ds_entry[3]]
+
+    def caches(self):
+        """
+        Caches of this predictor, by name.
+        """
+        return {"professions": self.cache}
+
     def _get_gender(self, profession: str, translated_sent: str, gold_gender: str, src_profession: str) -> GENDER:
         # initially try to resolve problem based on exact manual rules
         gender = self._get_gender_manual_rules(translated_sent, gold_gender, src_profession)
@@ -69,7 +86,12 @@ class MorfeuszPredictor:
         if gender is not GENDER.unknown:
             return gender
 
-        return self._get_gender_automatically(profession)
+        gender = self.cache.get(profession)
+        if gender is None:
+            gender = self._get_gender_automatically(profession)
+            self.cache[profession] = gender
+
+        return gender
 
     def _get_gender_manual_rules(self, translated_sent: str, gold_gender: str, src_profession: str) -> GENDER:
         # Rules defined and checked by Tomasz Limisiewicz
@@ -78,27 +100,19 @@ class MorfeuszPredictor:
 
         found_gender = GENDER.unknown
 
-        male = src_profession + "-male"
-        female = src_profession + "-female"
+        # a single scan finds all forms of the profession, and those preceded by `pani`, `panią`
+        hits = self.variant_matcher.match(src_profession, translated_sent)
 
         both_possible = False
-        if male in self.variants:
-            for form in self.variants[male]:
-                # don't match when profession is preceded by `mrs.` in Polish `pani`, `panią`
-                if re.search(form + "(\W|$)", translated_sent, flags=re.UNICODE) and \
-                        not re.search("(pani|panią) " + form + "(\W|$)", translated_sent, flags=re.UNICODE):
-                    found_gender = GENDER.male
-                    break
-
-        if female in self.variants:
-            for form in self.variants[female]:
-                if re.search(form + "(\W|$)", translated_sent, flags=re.UNICODE):
-                    if found_gender == GENDER.male:
-                        found_gender = GENDER.unknown
-                        both_possible = True
-                    else:
-                        found_gender = GENDER.female
-                    break
+        if hits.male - hits.guarded:
+            found_gender = GENDER.male
+
+        if hits.female:
+            if found_gender == GENDER.male:
+                found_gender = GENDER.unknown
+                both_possible = True
+            else:
+                found_gender = GENDER.female
 
         # our morphology analysis cannot analyze whole sentence, therefore if both are possible, mark it as correct
         # it is quite uncommon for Polish
@@ -11,41 +11,91 @@ from collections import defaultdict
 from operator import itemgetter
 from tqdm import tqdm
 from collections import Counter
+from typing import Dict, List
 import pymorphy2
 from pymorphy2.tokenizers import simple_word_tokenize
 from pymorphy2 import dawg
 
 # Local imports
 from languages.util import GENDER, PYMORPH_GENDER_TYPES
+from languages.lru_cache import LRUCache
 #=-----
 
+WORD_CACHE_SIZE = 1 << 18   # Max. words whose analysis is memoized
+
 class PymorphPredictor:
     """
     Class for PyMorph supported languages.
     These include Russian and Ukrainian.
     """
-    def __init__(self, lang: str):
+    def __init__(self, lang: str, word_cache_size: int = WORD_CACHE_SIZE):
         """
         Init pymorph for the specified language code.
         https://pymorphy2.readthedocs.io/en/latest/user/guide.html
         """
         assert lang in ["uk", "ru"]
         self.lang = lang
-        self.cache = {}    # Store calculated professions genders
+        self.cache = LRUCache()    # Store calculated professions genders
         self.tagger = pymorphy2.MorphAnalyzer(lang = lang)
 
+        # Professions differing in case endings share most of their words
+        self.word_cache = LRUCache(word_cache_size)
+
     def get_gender(self, profession: str, translated_sent = None, entity_index = None, ds_entry = None) -> GENDER:
         """
         Predict gender of an input profession.
         """
-        if profession not in self.cache:
-            self.cache[profession] = self._get_gender(profession)
+        gender = self.cache.get(profession)
+        if gender is None:
+            gender = self._get_gender(profession)
+            self.cache[profession] = gender
+
+        return gender
+
+    def cache_key(self, profession: str, translated_sent = None, entity_index = None, ds_entry = None):
+        """
+        Inputs the prediction depends on, see prediction_cache.py.
+        """
+        return profession
+
+    def caches(self):
+        """
+        Caches of this predictor, by name.
+        """
+        return {"professions": self.cache, "words": self.word_cache}
 
-        return self.cache[profession]
+    def get_genders(self, instances) -> List[GENDER]:
+        """
+        Predict genders for a list of
+        (profession, translated_sent, entity_index, ds_entry) tuples.
+        Only distinct uncached professions are predicted: the distinct
+        lowercased words across all of them are collected first, and each
+        is analyzed once (or found in the word cache).
+        """
+        professions = [instance[0] for instance in instances]
+        genders = {}
+        to_predict = []
+        for profession in dict.fromkeys(professions):
+            gender = self.cache.get(profession)
+            if gender is None:
+                to_predict.append(profession)
+            else:
+                genders[profession] = gender
+
+        words = dict.fromkeys(tok.lower() for profession in to_predict
+                              for tok in simple_word_tokenize(profession))
+        word_genders = {word: self.get_word_gender(word) for word in tqdm(words)}
+
+        for profession in to_predict:
+            genders[profession] = self._get_gender(profession, word_genders)
+            self.cache[profession] = genders[profession]
+
+        return [genders[profession] for profession in professions]
 
-    def _get_gender(self, profession: str) -> GENDER:
+    def _get_gender(self, profession: str, word_genders: Dict[str, GENDER] = None) -> GENDER:
         """
-        Predict gender, without using cache
+        Predict gender, without using cache.
+        word_genders, if given, holds the genders of the profession's lowercased words.
         """
         if not profession.strip():
             # Empty string
@@ -53,7 +103,10 @@ class PymorphPredictor:
 
         toks = simple_word_tokenize(profession)
 
-        observed_genders = [self.get_word_gender(tok) for tok in toks]
+        if word_genders is None:
+            observed_genders = [self.get_word_gender(tok) for tok in toks]
+        else:
+            observed_genders = [word_genders[tok.lower()] for tok in toks]
 
         if not observed_genders:
             # No observed gendered words - return unknown
@@ -62,7 +115,20 @@ class PymorphPredictor:
         # Return the most commonly observed gender
         return Counter(observed_genders).most_common()[0][0]
 
-    def get_word_gender(self, word):
+    def get_word_gender(self, word: str) -> GENDER:
+        """
+        Get the gender of a word, using cache.
+        Words are analyzed lowercased, as pymorphy2 does anyway.
+        """
+        word = word.lower()
+        gender = self.word_cache.get(word)
+        if gender is None:
+            gender = self._get_word_gender(word)
+            self.word_cache[word] = gender
+
+        return gender
+
+    def _get_word_gender(self, word: str) -> GENDER:
         """
         Get the most probable gender, based on the frequency of
         predictions.
@@ -0,0 +1,69 @@
+"""
+Client for predictor_server.py.
+"""
+# External imports
+import logging
+import pdb
+import json
+import urllib.error
+import urllib.request
+from tqdm import tqdm
+from typing import List
+
+# Local imports
+from languages.util import GENDER
+#=-----
+
+BATCH_SIZE = 1000   # Instances per request
+
+class RemotePredictor:
+    """
+    Client for a running predictor_server.py.
+    Exposes the same interface as the local predictors.
+    """
+    def __init__(self, lang: str, server_url: str):
+        """
+        Point the client at a server, e.g., http://localhost:8765
+        """
+        self.lang = lang
+        self.server_url = server_url.rstrip("/")
+
+    def get_gender(self, profession: str, translated_sent = None, entity_index = None, ds_entry = None) -> GENDER:
+        """
+        Predict gender of an input profession.
+        """
+        return self.get_genders([(profession, translated_sent, entity_index, ds_entry)])[0]
+
+    def get_genders(self, instances) -> List[GENDER]:
+        """
+        Predict genders for a list of
+        (profession, translated_sent, entity_index, ds_entry) tuples.
+        """
+        instances = list(instances)
+        genders = []
+        for start in range(0, len(instances), BATCH_SIZE):
+            batch = [list(instance) for instance in instances[start : start + BATCH_SIZE]]
+            response = self._post("/predict", {"lang": self.lang,
+                                               "instances": batch})
+            genders.extend(GENDER[gender] for gender in response["genders"])
+        return genders
+
+    def _post(self, path: str, payload):
+        """
+        Send a json request and decode the json response.
+        Server errors are raised with the server's message.
+        """
+        request = urllib.request.Request(self.server_url + path,
+                                         data = json.dumps(payload).encode("utf8"),
+                                         headers = {"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return json.loads(response.read().decode("utf8"))
+        except urllib.error.HTTPError as err:
+            body = err.read().decode("utf8", errors = "replace")
+            try:
+                message = json.loads(body)["error"]
+            except (ValueError, KeyError, TypeError):
+                # e.g., send_error's html pages
+                message = err.reason
+            raise RuntimeError(f"{self.server_url}{path} failed ({err.code}): {message}") from err
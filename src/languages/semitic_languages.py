@@ -15,6 +15,7 @@ from spacy.lang.he import Hebrew
 
 # Local imports
 from languages.util import GENDER
+from languages.lru_cache import LRUCache
 #=-----
 
 class HebrewPredictor:
@@ -26,17 +27,31 @@ class HebrewPredictor:
         Init tokenizer for Hebrew.
         """
         self.lang = "he"
-        self.cache = {}    # Store calculated professions genders
+        self.cache = LRUCache()    # Store calculated professions genders
         self.tokenizer = Hebrew().tokenizer
 
     def get_gender(self, profession: str, translated_sent = None, entity_index = None, ds_entry = None) -> GENDER:
         """
         Predict gender of an input profession.
         """
-        if profession not in self.cache:
-            self.cache[profession] = self._get_gender(profession)
+        gender = self.cache.get(profession)
+        if gender is None:
+            gender = self._get_gender(profession)
+            self.cache[profession] = gender
 
-        return self.cache[profession]
+        return gender
+
+    def cache_key(self, profession: str, translated_sent = None, entity_index = None, ds_entry = None):
+        """
+        Inputs the prediction depends on, see prediction_cache.py.
+        """
+        return profession
+
+    def caches(self):
+        """
+        Caches of this predictor, by name.
+        """
+        return {"professions": self.cache}
 
     def _get_gender(self, profession: str) -> GENDER:
         """
@@ -65,17 +80,31 @@ class ArabicPredictor:
         Init tokenizer for Arabic.
         """
         self.lang = "ar"
-        self.cache = {}    # Store calculated professions genders
+        self.cache = LRUCache()    # Store calculated professions genders
         self.tokenizer = lambda sent: sent.split() # Might be better with a dedicated Arabic tokenizer
 
     def get_gender(self, profession: str, translated_sent = None, entity_index = None, ds_entry = None) -> GENDER:
         """
         Predict gender of an input profession.
         """
-        if profession not in self.cache:
-            self.cache[profession] = self._get_gender(profession)
+        gender = self.cache.get(profession)
+        if gender is None:
+            gender = self._get_gender(profession)
+            self.cache[profession] = gender
 
-        return self.cache[profession]
+        return gender
+
+    def cache_key(self, profession: str, translated_sent = None, entity_index = None, ds_entry = None):
+        """
+        Inputs the prediction depends on, see prediction_cache.py.
+        """
+        return profession
+
+    def caches(self):
+        """
+        Caches of this predictor, by name.
+        """
+        return {"professions": self.cache}
 
     def _get_gender(self, profession: str) -> GENDER:
         """
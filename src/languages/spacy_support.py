@@ -11,26 +11,33 @@ from collections import defaultdict
 from operator import itemgetter
 from tqdm import tqdm
 from collections import Counter
+from typing import List
 import spacy
 
 # Local imports
 from languages.util import GENDER, get_gender_from_token
+from languages.lru_cache import LRUCache
 #=-----
 
+BATCH_SIZE = 1000   # Texts per nlp.pipe batch
+N_PROCESS = 1       # Processes used by nlp.pipe
+
 class SpacyPredictor:
     """
     Class for spaCy supported languages.
     These seem to include:
     Spanish, French, and Italian.
     """
-    def __init__(self, lang: str):
+    def __init__(self, lang: str, batch_size: int = BATCH_SIZE, n_process: int = N_PROCESS):
         """
         Init spacy for the specified language code.
         """
         assert lang in ["es", "fr", "it"]
         self.lang = lang
-        self.cache = {}    # Store calculated professions genders
+        self.cache = LRUCache()    # Store calculated professions genders
         self.nlp = spacy.load(self.lang, disable = ["parser", "ner"])
+        self.batch_size = batch_size
+        self.n_process = n_process
 
     def get_gender(self, profession: str, translated_sent = None, entity_index = None, ds_entry = None) -> GENDER:
         """
@@ -38,10 +45,50 @@ class SpacyPredictor:
         """
         if translated_sent == "Il venditore ha parlato con l'insegnante e l'ha invitata a cena.":
             pass
-        if profession not in self.cache:
-            self.cache[profession] = self._get_gender(profession)
+        gender = self.cache.get(profession)
+        if gender is None:
+            gender = self._get_gender(profession)
+            self.cache[profession] = gender
+
+        return gender
+
+    def cache_key(self, profession: str, translated_sent = None, entity_index = None, ds_entry = None):
+        """
+        Inputs the prediction depends on, see prediction_cache.py.
+        """
+        return profession
 
-        return self.cache[profession]
+    def caches(self):
+        """
+        Caches of this predictor, by name.
+        """
+        return {"professions": self.cache}
+
+    def get_genders(self, instances) -> List[GENDER]:
+        """
+        Predict genders for a list of
+        (profession, translated_sent, entity_index, ds_entry) tuples.
+        All distinct professions missing from the cache are parsed
+        in a single nlp.pipe pass.
+        """
+        professions = [instance[0] for instance in instances]
+        genders = {}
+        to_parse = []
+        for profession in dict.fromkeys(professions):
+            gender = self.cache.get(profession)
+            if gender is not None:
+                genders[profession] = gender
+            elif profession.strip():
+                to_parse.append(profession)
+            else:
+                # Empty string
+                genders[profession] = self.cache[profession] = GENDER.unknown
+
+        docs = self.nlp.pipe(to_parse, batch_size = self.batch_size, n_process = self.n_process)
+        for profession, toks in tqdm(zip(to_parse, docs), total = len(to_parse)):
+            genders[profession] = self.cache[profession] = self._get_gender_from_tokens(toks)
+
+        return [genders[profession] for profession in professions]
 
     def _get_gender(self, profession: str) -> GENDER:
         """
@@ -51,7 +98,12 @@ class SpacyPredictor:
             # Empty string
             return GENDER.unknown
 
-        toks = self.nlp(profession)
+        return self._get_gender_from_tokens(self.nlp(profession))
+
+    def _get_gender_from_tokens(self, toks) -> GENDER:
+        """
+        Predict gender from a parsed profession.
+        """
         observed_genders = [gender for gender in map(get_gender_from_token, toks)
                             if gender is not None]
 
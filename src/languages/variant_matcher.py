@@ -0,0 +1,123 @@
+""" Usage:
+    <file-name> --in=IN_FILE --out=OUT_FILE [--debug]
+"""
+# External imports
+import logging
+import pdb
+import re
+from docopt import docopt
+from collections import namedtuple
+from typing import Dict, List, Tuple
+
+# Local imports
+
+#=-----
+
+# Forms found in a sentence, and the ones preceded by a guard word
+VariantHits = namedtuple("VariantHits", ["male", "female", "guarded"])
+
+
+def trie_regex(forms: List[str]) -> str:
+    """
+    Build a single regex matching any of the given literal forms,
+    organized as a character trie so each position is scanned once.
+    Optional suffixes are greedy, so longer forms are tried first.
+    """
+    trie = {}
+    for form in forms:
+        node = trie
+        for char in form:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict) -> str:
+        alts = [re.escape(char) + build(child)
+                for char, child in sorted(node.items()) if char != ""]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        if "" in node:
+            body = "(?:" + body + ")?"
+        return body
+
+    return build(trie)
+
+
+class VariantMatcher:
+    """
+    Compiled matcher for tables of inflected profession forms, keyed by
+    "<profession>-male" and "<profession>-female".
+    Each profession's male and female forms are compiled once into a single
+    automaton, so one scan of a sentence finds all hits.
+    """
+    def __init__(self, variants: Dict[str, List[str]], boundary: str, guards: Tuple[str, ...] = ()):
+        """
+        boundary: regex which must follow a form, e.g., "[^a-z]".
+        guards: strings which, right before a form, mark it as guarded (e.g., "pani ").
+        """
+        self.variants = variants
+        self.boundary = boundary
+        self.boundary_re = re.compile(boundary)
+        self.guards = tuple(guards)
+        self.compiled = {}    # Profession -> (pattern, male forms, female forms, shorter forms)
+
+    def _compile(self, profession: str):
+        """
+        Compile the forms of a profession.
+        """
+        male_forms = set(self.variants.get(profession + "-male", []))
+        female_forms = set(self.variants.get(profession + "-female", []))
+        forms = male_forms | female_forms
+        if not forms:
+            return None
+
+        # A zero width match at every position, capturing the longest form there
+        pattern = re.compile("(?=(" + trie_regex(list(forms)) + ")(?:" + self.boundary + "))")
+
+        # Shorter forms which may also end on a boundary at the same position
+        shorter_forms = {form: [other for other in forms
+                                if (other != form) and form.startswith(other)]
+                         for form in forms}
+        return pattern, male_forms, female_forms, shorter_forms
+
+    def match(self, profession: str, sentence: str) -> VariantHits:
+        """
+        Find all male and female forms of the profession in the sentence.
+        Equivalent to searching each form followed by the boundary separately.
+        """
+        if profession not in self.compiled:
+            self.compiled[profession] = self._compile(profession)
+        compiled = self.compiled[profession]
+        hits = VariantHits(set(), set(), set())
+        if compiled is None:
+            return hits
+
+        pattern, male_forms, female_forms, shorter_forms = compiled
+        for match in pattern.finditer(sentence):
+            start = match.start()
+            form = match.group(1)
+            found = [form] + [other for other in shorter_forms[form]
+                              if self.boundary_re.match(sentence, start + len(other))]
+            guarded = bool(self.guards) and sentence.endswith(self.guards, 0, start)
+            for cur_form in found:
+                if cur_form in male_forms:
+                    hits.male.add(cur_form)
+                if cur_form in female_forms:
+                    hits.female.add(cur_form)
+                if guarded:
+                    hits.guarded.add(cur_form)
+        return hits
+
+
+if __name__ == "__main__":
+    # Parse command line arguments
+    args = docopt(__doc__)
+    inp_fn = args["--in"]
+    out_fn = args["--out"]
+    debug = args["--debug"]
+    if debug:
+        logging.basicConfig(level = logging.DEBUG)
+    else:
+        logging.basicConfig(level = logging.INFO)
+
+    logging.info("DONE")
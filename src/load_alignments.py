@@ -1,5 +1,22 @@
 """ Usage:
-    <file-name> --ds=DATASET_FILE --bi=IN_FILE --align=ALIGN_FILE --out=OUT_FILE --lang=LANG  [--debug]
+    <file-name> --ds=DATASET_FILE --bi=IN_FILE --out=OUT_FILE --lang=LANG [--align=ALIGN_FILE] [--aligner=ALIGNER] [--align-model=MODEL_FILE] [--server=SERVER_URL] [--cache=CACHE_DIR] [--pred-cache=DB_FILE] [--cache-size=CACHE_SIZE] [--batch-size=BATCH_SIZE] [--n-process=N_PROCESS] [--subset=NAME=FILE...] [--store=STORE_FILE] [--instances=STORE_DIR] [--system=SYSTEM] [--debug]
+
+--aligner: "fast_align" (default) reads fast_align's output from ALIGN_FILE
+           (a text file, or a folder converted with alignment_csr.py),
+           "ibm2" aligns the bitext in-process (see ibm2_aligner.py).
+--align-model: with ibm2, decode with a saved model instead of training on the bitext.
+
+--server: get predictions from a running predictor_server.py instead of loading the model.
+--cache: reuse predictions and metrics of unchanged cells (see cell_cache.py).
+--pred-cache: reuse single-instance predictions across runs, systems and datasets (see prediction_cache.py).
+--cache-size: max. entries of each in-memory predictor cache (see languages/lru_cache.py).
+--subset: after the metrics of the full dataset, print a "NAME;;;metrics" line for the
+          instances found in FILE (e.g., en_pro.txt), from the same predictions.
+--store: also record the metrics, as subset "all" and each NAME, in a results store
+         (see results_store.py). SYSTEM defaults to the bitext's folder name.
+--instances: also write the per-instance predictions to a columnar store (see instance_store.py).
+--batch-size, --n-process: nlp.pipe settings for the spaCy based predictors (es, fr, it, de),
+                           --n-process also sets the number of tagging processes for cs.
 """
 # External imports
 import logging
@@ -9,9 +26,11 @@ from pprint import pformat
 from docopt import docopt
 from collections import defaultdict, Counter
 from operator import itemgetter
+from functools import partial
 from tqdm import tqdm
-from typing import List
+from typing import List, Dict
 import csv
+import json
 
 # Local imports
 from languages.spacy_support import SpacyPredictor
@@ -21,10 +40,21 @@ from languages.gendered_article import GenderedArticlePredictor, \
 from languages.pymorph_support import PymorphPredictor
 from languages.semitic_languages import HebrewPredictor, ArabicPredictor
 from languages.morfeusz_support import MorfeuszPredictor
-from evaluate import evaluate_bias
+from evaluate import evaluate_bias, evaluate_subset, read_predictions, subset_mask
+from results_store import ResultsStore, make_record, system_name
+from instance_store import InstanceStore
 from languages.czech import CzechPredictor
+from languages.remote_predictor import RemotePredictor
+from cell_cache import CellCache, DEFAULT_ALIGN_PARAMS
+from prediction_cache import PredictionCache, CachedPredictor
+from languages.lru_cache import predictor_caches, log_cache_stats
+from alignment_store import file_hash
+from alignment_csr import is_csr, CsrAlignments
+from ibm2_aligner import align_bitext as ibm2_align_bitext
 #=-----
 
+ALIGNERS = ["fast_align", "ibm2"]
+
 LANGAUGE_PREDICTOR = {
     "es": lambda: SpacyPredictor("es"),
     "fr": lambda: SpacyPredictor("fr"),
@@ -55,11 +85,48 @@ def get_src_indices(instance: List[str]) -> List[int]:
 
     return src_indices
 
-def get_translated_professions(alignment_fn: str, ds: List[List[str]], bitext: List[List[str]]) -> List[str]:
+def read_alignments(align_fn: str, line_inds: List[int] = None) -> List[Dict[int, List[int]]]:
+    """
+    Parse fast_align's output into a {source index: [target indices]}
+    dict per line. Converted CSR folders are memory-mapped instead,
+    and only the looked up lines are read.
+    With line_inds, only these lines are parsed, into a {line index: alignment} dict.
+    """
+    if is_csr(align_fn):
+        return CsrAlignments(align_fn)
+    wanted = set(line_inds) if line_inds is not None else None
+    full_alignments = [] if wanted is None else {}
+    for line_ind, line in enumerate(open(align_fn)):
+        if (wanted is not None) and (line_ind not in wanted):
+            continue
+        cur_align = defaultdict(list)
+        for word in line.split():
+            src, tgt = word.split("-")
+            cur_align[int(src)].append(int(tgt))
+        if wanted is None:
+            full_alignments.append(cur_align)
+        else:
+            full_alignments[line_ind] = cur_align
+    return full_alignments
+
+def get_alignments(full_bitext: List[List[str]], align_fn: str = None,
+                   aligner: str = "fast_align", align_model_fn: str = None) -> List[Dict[int, List[int]]]:
+    """
+    Alignments for every line of the bitext, either read from
+    fast_align's output or computed in-process (decoding with
+    a saved model, if given).
+    """
+    if aligner == "fast_align":
+        return read_alignments(align_fn)
+    if aligner == "ibm2":
+        return ibm2_align_bitext(full_bitext, model_fn = align_model_fn)
+    raise ValueError(f"Unknown aligner: {aligner}")
+
+def get_translated_professions(full_alignments: List[Dict[int, List[int]]], ds: List[List[str]], bitext: List[List[str]]) -> List[str]:
     """
     (Language independent)
-    Load alignments from file and return the translated profession according to
-    source indices.
+    Return the translated profession according to source indices,
+    given the alignments of the full bitext.
     """
     # Load files and data structures
     ds_src_sents = list(map(itemgetter(2), ds))
@@ -77,15 +144,6 @@ def get_translated_professions(alignment_fn: str, ds: List[List[str]], bitext: L
 
     src_indices = list(map(get_src_indices, ds))
 
-    full_alignments = []
-    for line in open(align_fn):
-        cur_align = defaultdict(list)
-        for word in line.split():
-            src, tgt = word.split("-")
-            cur_align[int(src)].append(int(tgt))
-        full_alignments.append(cur_align)
-
-
     bitext_inds = [ind for ind, _ in bitext]
 
     alignments = []
@@ -127,6 +185,68 @@ def output_predictions(target_sentences, gender_predictions, out_fn):
         for sent, gender in zip(target_sentences, gender_predictions):
             writer.writerow([sent, str(gender).split(".")[1]])
 
+def load_dataset(ds_fn: str) -> List[List[str]]:
+    """
+    Read a tab separated dataset file (gold, index, sentence, profession).
+    """
+    return [line.strip().split("\t") for line in open(ds_fn, encoding = "utf8")]
+
+def load_bitext(bi_fn: str) -> List[List[str]]:
+    """
+    Read a `src ||| tgt` bitext file.
+    """
+    return [line.strip().split(" ||| ")
+            for line in open(bi_fn, encoding = "utf8")]
+
+def predict_instances(gender_predictor, instances):
+    """
+    Predict genders for a list of
+    (profession, translated_sent, entity_index, ds_entry) tuples,
+    using the predictor's batch interface when it has one.
+    """
+    if hasattr(gender_predictor, "get_genders"):
+        return gender_predictor.get_genders(instances)
+    return [gender_predictor.get_gender(*instance)
+            for instance in tqdm(instances)]
+
+def predict_genders(gender_predictor, translated_profs, target_sentences, tgt_inds, ds):
+    """
+    Run the gender predictor over all instances.
+    """
+    instances = list(zip(translated_profs,
+                         target_sentences,
+                         map(lambda ls:min(ls, default = -1), tgt_inds),
+                         ds))
+    return predict_instances(gender_predictor, instances)
+
+def evaluate_bitext(gender_predictor, ds, bi_fn, align_fn, out_fn, aligner = "fast_align",
+                    align_model_fn = None, instances_out = None):
+    """
+    Align, predict and evaluate a single bitext against the dataset.
+    Writes the per-instance predictions to out_fn and returns the
+    metrics dictionary.
+    instances_out, if given, is called with the dataset, translated professions,
+    target indices and predictions (e.g., a bound InstanceStore.put).
+    """
+    full_bitext = load_bitext(bi_fn)
+    bitext = align_bitext_to_ds(full_bitext, ds)
+    full_alignments = get_alignments(full_bitext, align_fn, aligner, align_model_fn)
+
+    translated_profs, tgt_inds = get_translated_professions(full_alignments, ds, bitext)
+    assert(len(translated_profs) == len(tgt_inds))
+
+    target_sentences = [tgt_sent for (ind, (src_sent, tgt_sent)) in bitext]
+
+    gender_predictions = predict_genders(gender_predictor, translated_profs,
+                                         target_sentences, tgt_inds, ds)
+
+    # Output predictions
+    output_predictions(target_sentences, gender_predictions, out_fn)
+    if instances_out is not None:
+        instances_out(ds, translated_profs, tgt_inds, gender_predictions)
+
+    return evaluate_bias(ds, gender_predictions)
+
 def align_bitext_to_ds(bitext, ds):
     """
     Return a subset of bitext that's aligned to ds.
@@ -145,8 +265,20 @@ if __name__ == "__main__":
     ds_fn = args["--ds"]
     bi_fn = args["--bi"]
     align_fn = args["--align"]
+    aligner = args["--aligner"] or "fast_align"
+    align_model_fn = args["--align-model"]
     out_fn = args["--out"]
     lang = args["--lang"]
+    server_url = args["--server"]
+    cache_dir = args["--cache"]
+    pred_cache_fn = args["--pred-cache"]
+    cache_size = args["--cache-size"]
+    subsets = [subset.split("=", 1) for subset in args["--subset"]]
+    store_fn = args["--store"]
+    instances_dir = args["--instances"]
+    system = args["--system"] or system_name(bi_fn)
+    batch_size = args["--batch-size"]
+    n_process = args["--n-process"]
 
     debug = args["--debug"]
     if debug:
@@ -154,29 +286,63 @@ if __name__ == "__main__":
     else:
         logging.basicConfig(level = logging.INFO)
 
-    gender_predictor = LANGAUGE_PREDICTOR[lang]()
-
-    ds = [line.strip().split("\t") for line in open(ds_fn, encoding = "utf8")]
-    full_bitext = [line.strip().split(" ||| ")
-              for line in open(bi_fn, encoding = "utf8")]
-    bitext = align_bitext_to_ds(full_bitext, ds)
-
-    translated_profs, tgt_inds = get_translated_professions(align_fn, ds, bitext)
-    assert(len(translated_profs) == len(tgt_inds))
-
-    target_sentences = [tgt_sent for (ind, (src_sent, tgt_sent)) in bitext]
-
-    gender_predictions = [gender_predictor.get_gender(prof, translated_sent, entity_index, ds_entry)
-                          for prof, translated_sent, entity_index, ds_entry
-                          in tqdm(zip(translated_profs,
-                                      target_sentences,
-                                      map(lambda ls:min(ls, default = -1), tgt_inds),
-                                      ds))]
-
-    # Output predictions
-    output_predictions(target_sentences, gender_predictions, out_fn)
-
-    d = evaluate_bias(ds, gender_predictions)
-
+    assert aligner in ALIGNERS, f"{aligner} is not supported"
+    if (aligner == "fast_align") and (align_fn is None):
+        raise ValueError("--align is required with fast_align")
+
+    instance_store = InstanceStore(instances_dir) if instances_dir else None
+    instances_out = None
+    if instance_store is not None:
+        instances_out = partial(instance_store.put, lang, system, ds_fn, bi_fn)
+
+    cache = CellCache(cache_dir) if cache_dir else None
+    d = None
+    if cache is not None:
+        align_params = DEFAULT_ALIGN_PARAMS if aligner == "fast_align" else aligner
+        if align_model_fn is not None:
+            align_params += " " + file_hash(align_model_fn)
+        cache_key = cache.key(ds_fn, bi_fn, lang, align_params)
+    # A cached cell has no instances to store
+    if (cache is not None) and \
+       ((instance_store is None) or instance_store.has(lang, system, ds_fn, bi_fn)):
+        d = cache.restore(cache_key, out_fn)
+        if d is not None:
+            logging.info(f"Found cached evaluation for {bi_fn}")
+            print(json.dumps(d))
+
+    if d is None:
+        if server_url:
+            gender_predictor = RemotePredictor(lang, server_url)
+        else:
+            gender_predictor = LANGAUGE_PREDICTOR[lang]()
+            if batch_size and hasattr(gender_predictor, "batch_size"):
+                gender_predictor.batch_size = int(batch_size)
+            if n_process and hasattr(gender_predictor, "n_process"):
+                gender_predictor.n_process = int(n_process)
+            if cache_size:
+                for predictor_cache in predictor_caches(gender_predictor).values():
+                    predictor_cache.resize(int(cache_size))
+        if pred_cache_fn:
+            gender_predictor = CachedPredictor(gender_predictor, PredictionCache(pred_cache_fn), lang)
+
+        ds = load_dataset(ds_fn)
+        d = evaluate_bitext(gender_predictor, ds, bi_fn, align_fn, out_fn, aligner, align_model_fn,
+                            instances_out)
+        log_cache_stats(gender_predictor)
+
+        if cache is not None:
+            cache.put(cache_key, out_fn, d)
+
+    records = [make_record(system, lang, ds_fn, "all", d)]
+    if subsets:
+        ds = load_dataset(ds_fn)
+        predicted = read_predictions(out_fn)
+        for name, subset_fn in subsets:
+            subset_d = evaluate_subset(ds, predicted, subset_mask(ds, subset_fn))
+            print(f"{name};;;{json.dumps(subset_d)}")
+            records.append(make_record(system, lang, ds_fn, name, subset_d))
+
+    if store_fn:
+        ResultsStore(store_fn).add_many(records)
 
     logging.info("DONE")
@@ -0,0 +1,144 @@
+""" Usage:
+    <file-name> --db=DB_FILE [--debug]
+
+Print the number of cached predictions per language and predictor version.
+"""
+# External imports
+import logging
+import pdb
+import json
+import sqlite3
+from pprint import pprint
+from pprint import pformat
+from docopt import docopt
+from tqdm import tqdm
+from typing import Dict, List
+
+# Local imports
+from languages.util import GENDER
+from languages.lru_cache import predictor_caches
+from cell_cache import LANGUAGE_FILES, predictor_fingerprint
+#=-----
+
+QUERY_CHUNK_SIZE = 500   # Keys per SELECT, below SQLite's variables limit
+
+
+class PredictionCache:
+    """
+    On-disk store of single-instance predictions, shared across runs and processes.
+    Entries are keyed by language, predictor version (see predictor_fingerprint)
+    and the inputs the predictor depends on.
+    """
+    def __init__(self, db_fn: str):
+        self.db_fn = db_fn
+        self.version = predictor_fingerprint(LANGUAGE_FILES)
+        self.conn = sqlite3.connect(db_fn, timeout = 60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS predictions ("
+                              "lang TEXT, version TEXT, key TEXT, gender INTEGER, "
+                              "PRIMARY KEY (lang, version, key)) WITHOUT ROWID")
+
+    def get_many(self, lang: str, keys: List[str]) -> Dict[str, GENDER]:
+        """
+        Return the cached genders of the given keys, omitting misses.
+        """
+        found = {}
+        for start in range(0, len(keys), QUERY_CHUNK_SIZE):
+            chunk = keys[start : start + QUERY_CHUNK_SIZE]
+            query = ("SELECT key, gender FROM predictions WHERE lang = ? AND version = ? "
+                     f"AND key IN ({','.join('?' * len(chunk))})")
+            for key, gender in self.conn.execute(query, [lang, self.version] + chunk):
+                found[key] = GENDER(gender)
+        return found
+
+    def put_many(self, lang: str, genders: Dict[str, GENDER]):
+        """
+        Store predictions, in a single transaction.
+        """
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO predictions VALUES (?, ?, ?, ?)",
+                                  [(lang, self.version, key, gender.value)
+                                   for key, gender in genders.items()])
+
+    def counts(self) -> List:
+        """
+        Number of entries per (language, version).
+        """
+        return self.conn.execute("SELECT lang, version, COUNT(*) FROM predictions "
+                                 "GROUP BY lang, version").fetchall()
+
+
+class CachedPredictor:
+    """
+    Wrap a gender predictor with a PredictionCache.
+    The predictor's cache_key method, when it has one, names the inputs
+    its prediction depends on. Otherwise the whole instance is used.
+    """
+    def __init__(self, gender_predictor, cache: PredictionCache, lang: str):
+        self.gender_predictor = gender_predictor
+        self.cache = cache
+        self.lang = lang
+
+    def cache_key(self, profession: str, translated_sent, entity_index, ds_entry) -> str:
+        if hasattr(self.gender_predictor, "cache_key"):
+            key = self.gender_predictor.cache_key(profession, translated_sent, entity_index, ds_entry)
+        else:
+            key = [profession, translated_sent, entity_index, list(ds_entry)]
+        return json.dumps([type(self.gender_predictor).__name__, key], ensure_ascii = False)
+
+    def caches(self):
+        """
+        In-memory caches of the wrapped predictor.
+        """
+        return predictor_caches(self.gender_predictor)
+
+    def get_gender(self, profession: str, translated_sent = None, entity_index = None, ds_entry = None) -> GENDER:
+        """
+        Predict gender of an input profession.
+        """
+        return self.get_genders([(profession, translated_sent, entity_index, ds_entry)])[0]
+
+    def get_genders(self, instances) -> List[GENDER]:
+        """
+        Predict genders for a list of
+        (profession, translated_sent, entity_index, ds_entry) tuples.
+        Only cache misses are passed on to the wrapped predictor.
+        """
+        keys = [self.cache_key(*instance) for instance in instances]
+        found = self.cache.get_many(self.lang, list(set(keys)))
+        logging.debug(f"Prediction cache: {len(found)} hits out of {len(set(keys))} keys")
+
+        missing = {}
+        for key, instance in zip(keys, instances):
+            if key not in found:
+                missing.setdefault(key, instance)
+
+        if missing:
+            missing_instances = list(missing.values())
+            if hasattr(self.gender_predictor, "get_genders"):
+                genders = self.gender_predictor.get_genders(missing_instances)
+            else:
+                genders = [self.gender_predictor.get_gender(*instance)
+                           for instance in tqdm(missing_instances)]
+            new_genders = dict(zip(missing, genders))
+            self.cache.put_many(self.lang, new_genders)
+            found.update(new_genders)
+
+        return [found[key] for key in keys]
+
+
+if __name__ == "__main__":
+    # Parse command line arguments
+    args = docopt(__doc__)
+    db_fn = args["--db"]
+    debug = args["--debug"]
+    if debug:
+        logging.basicConfig(level = logging.DEBUG)
+    else:
+        logging.basicConfig(level = logging.INFO)
+
+    for lang, version, count in PredictionCache(db_fn).counts():
+        print(f"{lang}\t{version}\t{count}")
+
+    logging.info("DONE")
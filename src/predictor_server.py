@@ -0,0 +1,165 @@
+""" Usage:
+    <file-name> [--host=HOST] [--port=PORT] [--langs=LANGS] [--debug]
+
+Long-lived gender prediction server, keeping one warm predictor per language.
+Predictors for LANGS (comma separated) are loaded on startup, others on first use.
+
+    POST /predict  {"lang": "es", "instances": [[profession, translated_sent, entity_index, ds_entry], ...]}
+                   -> {"genders": ["male", ...]}, or {"error": message} with status 400 or 500
+    GET  /status   -> {"langs": [loaded languages], "caches": {lang: {cache name: stats}}}
+
+Use from load_alignments.py with --server=http://HOST:PORT
+"""
+# External imports
+import logging
+import pdb
+import json
+import threading
+from pprint import pprint
+from pprint import pformat
+from docopt import docopt
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local imports
+from load_alignments import LANGAUGE_PREDICTOR, predict_instances
+from languages.lru_cache import predictor_caches
+#=-----
+
+DEFAULT_HOST = "localhost"
+DEFAULT_PORT = 8765
+
+
+class PredictorPool:
+    """
+    One warm predictor per language.
+    Predictors keep per-instance state (caches, tagger buffers),
+    so each one is guarded by its own lock, which is also held while
+    it loads, so loading one language doesn't block the others.
+    """
+    def __init__(self):
+        self.predictors = {}
+        self.locks = {}
+        self.pool_lock = threading.Lock()
+
+    def lang_lock(self, lang: str) -> threading.Lock:
+        with self.pool_lock:
+            return self.locks.setdefault(lang, threading.Lock())
+
+    def load(self, lang: str):
+        """
+        Load the predictor for lang, if it isn't loaded already.
+        """
+        if lang in self.predictors:
+            return
+        if lang not in LANGAUGE_PREDICTOR:
+            raise KeyError(f"{lang} is not supported")
+        with self.lang_lock(lang):
+            if lang not in self.predictors:
+                logging.info(f"Loading {lang} predictor")
+                predictor = LANGAUGE_PREDICTOR[lang]()
+                with self.pool_lock:
+                    self.predictors[lang] = predictor
+
+    def loaded(self):
+        """
+        Snapshot of the loaded predictors, by language.
+        """
+        with self.pool_lock:
+            return dict(self.predictors)
+
+    def predict(self, lang: str, instances):
+        """
+        Predict genders for a batch of instances.
+        """
+        self.load(lang)
+        with self.lang_lock(lang):
+            return predict_instances(self.predictors[lang], instances)
+
+
+class PredictorHandler(BaseHTTPRequestHandler):
+    """
+    Json over HTTP front end for a PredictorPool.
+    """
+    pool = None
+
+    def do_GET(self):
+        if self.path != "/status":
+            self.send_error(404)
+            return
+        predictors = self.pool.loaded()
+        caches = {lang: {name: cache.stats() for name, cache in predictor_caches(predictor).items()}
+                  for lang, predictor in predictors.items()}
+        self._send_json(200, {"langs": sorted(predictors),
+                              "caches": caches})
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self.send_error(404)
+            return
+        try:
+            lang, instances = self._parse_request()
+        except ValueError as err:
+            self._send_json(400, {"error": str(err)})
+            return
+        try:
+            genders = self.pool.predict(lang, instances)
+        except Exception as err:
+            logging.exception(f"Failed predicting for {lang}")
+            self._send_json(500, {"error": repr(err)})
+            return
+        self._send_json(200, {"genders": [gender.name for gender in genders]})
+
+    def _parse_request(self):
+        """
+        The language and instances of a /predict request,
+        raising ValueError on a malformed or unsupported request.
+        """
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length).decode("utf8"))
+            lang = request["lang"]
+            instances = [tuple(instance) for instance in request["instances"]]
+        except (ValueError, KeyError, TypeError) as err:
+            raise ValueError(f"Malformed request: {err!r}")
+        if lang not in LANGAUGE_PREDICTOR:
+            raise ValueError(f"{lang} is not supported")
+        return lang, instances
+
+    def _send_json(self, code: int, payload):
+        body = json.dumps(payload).encode("utf8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+
+if __name__ == "__main__":
+    # Parse command line arguments
+    args = docopt(__doc__)
+    host = args["--host"] or DEFAULT_HOST
+    port = int(args["--port"]) if args["--port"] else DEFAULT_PORT
+    langs = args["--langs"].split(",") if args["--langs"] else []
+    debug = args["--debug"]
+    if debug:
+        logging.basicConfig(level = logging.DEBUG)
+    else:
+        logging.basicConfig(level = logging.INFO)
+
+    pool = PredictorPool()
+    for lang in langs:
+        pool.load(lang)
+
+    PredictorHandler.pool = pool
+    server = ThreadingHTTPServer((host, port), PredictorHandler)
+    logging.info(f"Serving on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+    logging.info("DONE")
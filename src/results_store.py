@@ -0,0 +1,123 @@
+""" Usage:
+    <file-name> --store=STORE_FILE [--system=SYSTEM] [--lang=LANG] [--ds=DATASET_FILE] [--subset=SUBSET] [--debug]
+
+Print the latest metrics recorded in a results store, one json record per line,
+optionally filtered by system, language, dataset and subset.
+"""
+# External imports
+import logging
+import pdb
+import os
+import json
+import time
+import fcntl
+from pprint import pprint
+from pprint import pformat
+from docopt import docopt
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# Local imports
+from alignment_store import file_hash
+#=-----
+
+RESULT_KEY = ["system", "lang", "ds", "subset"]      # ds: the dataset's content hash
+
+
+def system_name(bi_fn: str) -> str:
+    """
+    Name of the translation system of a bitext,
+    e.g., ../translations/google/en-es.txt -> google.
+    """
+    return Path(bi_fn).parent.name
+
+def record_key(record: Dict) -> Tuple:
+    return tuple(record[field] for field in RESULT_KEY)
+
+def make_record(system: str, lang: str, ds_fn: str, subset: str, metrics: Dict) -> Dict:
+    """
+    The dataset is keyed by its content hash, so records don't depend on
+    the working directory; its path is kept for display only.
+    """
+    return {"system": system,
+            "lang": lang,
+            "ds": file_hash(ds_fn),
+            "ds_path": os.path.abspath(ds_fn),
+            "subset": subset,
+            "metrics": metrics,
+            "time": time.time()}
+
+
+class ResultsStore:
+    """
+    Append-only JSONL store of evaluation metrics, keyed by
+    system, language, dataset and subset (see RESULT_KEY).
+    Writes are single appends under an exclusive lock, so concurrent runs
+    never interleave, and later records of a key supersede earlier ones.
+    Reruns of unchanged cells are appended too, and deduplicated when
+    querying (see latest).
+    """
+    def __init__(self, store_fn: str):
+        self.store_fn = store_fn
+        Path(store_fn).parent.mkdir(parents = True, exist_ok = True)
+
+    def add(self, system: str, lang: str, ds_fn: str, subset: str, metrics: Dict):
+        self.add_many([make_record(system, lang, ds_fn, subset, metrics)])
+
+    def add_many(self, records: List[Dict]):
+        """
+        Append records (see make_record) in a single write, one line each.
+        """
+        data = "".join(json.dumps(record) + "\n" for record in records)
+        with open(self.store_fn, "a", encoding = "utf8") as fout:
+            fcntl.flock(fout, fcntl.LOCK_EX)
+            try:
+                fout.write(data)
+                fout.flush()
+            finally:
+                fcntl.flock(fout, fcntl.LOCK_UN)
+
+    def records(self):
+        """
+        Iterate over all records, in the order they were written.
+        """
+        if not os.path.exists(self.store_fn):
+            return
+        with open(self.store_fn, encoding = "utf8") as fin:
+            for line_ind, line in enumerate(fin):
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    logging.warning(f"Skipping malformed line {line_ind} in {self.store_fn}")
+
+    def latest(self, **filters) -> Dict[Tuple, Dict]:
+        """
+        Latest record of each key, keeping only records whose
+        fields equal the given filters (e.g., lang = "es").
+        A ds filter is a dataset file, matched by content.
+        """
+        if "ds" in filters:
+            filters["ds"] = file_hash(filters["ds"])
+        found = {}
+        for record in self.records():
+            if all(record[field] == value for field, value in filters.items()):
+                found[record_key(record)] = record
+        return found
+
+
+if __name__ == "__main__":
+    # Parse command line arguments
+    args = docopt(__doc__)
+    store_fn = args["--store"]
+    filters = {field: args[f"--{field}"] for field in RESULT_KEY
+               if args[f"--{field}"] is not None}
+    debug = args["--debug"]
+    if debug:
+        logging.basicConfig(level = logging.DEBUG)
+    else:
+        logging.basicConfig(level = logging.INFO)
+
+    for key, record in sorted(ResultsStore(store_fn).latest(**filters).items()):
+        print(json.dumps(record))
+
+    logging.info("DONE")
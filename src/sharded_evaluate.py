@@ -0,0 +1,298 @@
+""" Usage:
+    <file-name> --ds=DATASET_FILE --bi=IN_FILE --lang=LANG --out=OUT_FILE [--align=ALIGN_FILE] [--aligner=ALIGNER] [--align-model=MODEL_FILE] [--shard-size=LINES] [--workers=NUM_WORKERS] [--worker-cmd=CMD...] [--debug]
+    <file-name> --worker [--debug]
+
+Evaluate a bitext in shards of the dataset's line ranges, and merge the results
+into the same predictions file and metrics as load_alignments.py.
+
+Coordinator mode (default) splits DATASET_FILE into ranges of LINES lines (default 1000).
+By default shards run in a local pool of NUM_WORKERS processes (default: cpu count).
+With --worker-cmd, each CMD is a long-lived worker process instead, e.g.,
+    --worker-cmd="ssh node1 'cd mt_gender/src && python sharded_evaluate.py --worker'"
+File paths are sent as given, so remote workers need them on a shared file system.
+
+Worker mode reads one json shard task per line from stdin, and writes one json
+result per line to stdout: the shard's predicted gender codes and its metric
+counts (see evaluate.BiasAccumulator).
+
+The coordinator indexes the byte offsets of the dataset and bitext lines in a
+single pass, and each shard seeks to and reads only its own lines of both,
+and of the alignments.
+Alignments are read from ALIGN_FILE's CSR conversion (fast_align output is converted
+once, next to it, see alignment_csr.py), or decoded per shard with a saved ibm2 model
+(--aligner=ibm2 --align-model=MODEL_FILE).
+"""
+# External imports
+import logging
+import pdb
+import os
+import sys
+import csv
+import json
+import queue
+import shlex
+import threading
+import subprocess
+from array import array
+from multiprocessing import Pool
+from pprint import pprint
+from pprint import pformat
+from docopt import docopt
+from tqdm import tqdm
+from typing import Dict, List, Tuple
+import numpy as np
+
+# Local imports
+from load_alignments import get_translated_professions, predict_genders
+from evaluate import BiasAccumulator
+from evaluate_matrix import get_predictor
+from ibm2_aligner import align_bitext as ibm2_align_bitext
+from alignment_csr import is_csr, ensure_csr, CsrAlignments
+from split_translations import sentence_hash
+from languages.util import GENDER
+#=-----
+
+SHARD_SIZE = 1000
+
+
+def line_offsets(fn: str, parse) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Byte offset of each line of a file, and the sentence hash of
+    the source sentence parse(line) extracts from it.
+    """
+    offsets = array("q")
+    hashes = array("Q")
+    offset = 0
+    with open(fn, "rb") as fin:
+        for line in fin:
+            offsets.append(offset)
+            hashes.append(sentence_hash(parse(line.decode("utf8"))))
+            offset += len(line)
+    return np.frombuffer(offsets, dtype = np.int64), np.frombuffer(hashes, dtype = np.uint64)
+
+def index_files(ds_fn: str, bi_fn: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    In a single pass over both files: the byte offset of each dataset line,
+    and the index and byte offset of its bitext line.
+    Same matching as align_bitext_to_ds: by source sentence, the last occurrence wins.
+    """
+    bi_offsets, bi_hashes = line_offsets(bi_fn, lambda line: line.split(" ||| ")[0].strip())
+    ds_offsets, ds_hashes = line_offsets(ds_fn, lambda line: line.strip().split("\t")[2])
+    order = np.argsort(bi_hashes, kind = "stable")
+    sorted_hashes = bi_hashes[order]
+    pos = np.searchsorted(sorted_hashes, ds_hashes, side = "right") - 1
+    missing = (pos < 0) | (sorted_hashes[np.maximum(pos, 0)] != ds_hashes)
+    if missing.any():
+        raise KeyError(f"Dataset line {int(np.argmax(missing))} is missing from {bi_fn}")
+    bi_inds = order[pos]
+    return ds_offsets, bi_inds, bi_offsets[bi_inds]
+
+def read_lines_at(fin, offset: int, num_lines: int) -> List[str]:
+    """
+    Read num_lines lines of a binary file, starting at a byte offset.
+    """
+    fin.seek(offset)
+    return [fin.readline().decode("utf8") for _ in range(num_lines)]
+
+def load_dataset_range(ds_fn: str, offset: int, num_lines: int) -> List[List[str]]:
+    """
+    Read the shard's lines of a tab separated dataset file.
+    """
+    with open(ds_fn, "rb") as fin:
+        return [line.strip().split("\t") for line in read_lines_at(fin, offset, num_lines)]
+
+def load_shard_bitext(bi_fn: str, ds: List[List[str]], bi_inds: List[int],
+                      bi_offsets: List[int]) -> List[Tuple[int, Tuple[str, str]]]:
+    """
+    Read only the bitext lines of the shard's instances (see index_files).
+    Same output as align_bitext_to_ds on the full bitext.
+    """
+    new_bitext = []
+    with open(bi_fn, "rb") as fin:
+        for entry, ind, offset in zip(ds, bi_inds, bi_offsets):
+            src_sent, tgt_sent = read_lines_at(fin, offset, 1)[0].strip().split(" ||| ")
+            assert src_sent == entry[2], f"Bitext line {ind} doesn't match the dataset"
+            new_bitext.append((ind, (src_sent, tgt_sent)))
+    return new_bitext
+
+def shard_alignments(task: Dict, bitext: List[Tuple[int, Tuple[str, str]]]):
+    """
+    Alignments of the shard's bitext lines, by line index.
+    fast_align's are looked up in the memory-mapped CSR arrays,
+    which only read the shard's lines.
+    """
+    if task["aligner"] == "ibm2":
+        alignments = ibm2_align_bitext([pair for _, pair in bitext], model_fn = task["align_model"])
+        return {ind: alignment for (ind, _), alignment in zip(bitext, alignments)}
+    csr = CsrAlignments(task["align"])
+    return {ind: csr[ind] for ind, _ in bitext}
+
+def evaluate_shard(task: Dict) -> Dict:
+    """
+    Predict and count a single shard, with the predictor of the current process.
+    """
+    ds = load_dataset_range(task["ds"], task["ds_offset"], task["end"] - task["start"])
+    bitext = load_shard_bitext(task["bi"], ds, task["bi_inds"], task["bi_offsets"])
+    alignments = shard_alignments(task, bitext)
+
+    translated_profs, tgt_inds = get_translated_professions(alignments, ds, bitext)
+    target_sentences = [tgt_sent for (ind, (src_sent, tgt_sent)) in bitext]
+    gender_predictions = predict_genders(get_predictor(task["lang"]), translated_profs,
+                                         target_sentences, tgt_inds, ds)
+
+    accumulator = BiasAccumulator()
+    accumulator.add_batch(ds, gender_predictions)
+    return {"start": task["start"],
+            "end": task["end"],
+            "genders": [gender.value for gender in gender_predictions],
+            "counts": accumulator.to_dict()}
+
+def make_tasks(ds_fn: str, bi_fn: str, lang: str, align_fn: str, aligner: str,
+               align_model_fn: str, shard_size: int, ds_offsets: np.ndarray,
+               bi_inds: np.ndarray, bi_offsets: np.ndarray) -> List[Dict]:
+    """
+    One task per range of shard_size dataset lines, with the byte offset
+    of its first line, and the bitext line index and offset of each instance
+    (see index_files).
+    """
+    num_lines = len(ds_offsets)
+    return [{"ds": ds_fn, "bi": bi_fn, "lang": lang,
+             "align": align_fn, "aligner": aligner, "align_model": align_model_fn,
+             "start": start, "end": min(start + shard_size, num_lines),
+             "ds_offset": int(ds_offsets[start]),
+             "bi_inds": bi_inds[start : start + shard_size].tolist(),
+             "bi_offsets": bi_offsets[start : start + shard_size].tolist()}
+            for start in range(0, num_lines, shard_size)]
+
+def run_local(tasks: List[Dict], num_workers: int):
+    """
+    Evaluate shards in a local process pool, yielding results as they finish.
+    """
+    with Pool(num_workers) as pool:
+        yield from pool.imap_unordered(evaluate_shard, tasks)
+
+def run_commands(tasks: List[Dict], worker_cmds: List[str]):
+    """
+    Evaluate shards in long-lived worker processes (see --worker),
+    each fed one task at a time, yielding results as they finish.
+    """
+    pending = queue.Queue()
+    for task in tasks:
+        pending.put(task)
+    results = queue.Queue()
+
+    def feed(worker_cmd: str):
+        proc = subprocess.Popen(worker_cmd, shell = True, stdin = subprocess.PIPE,
+                                stdout = subprocess.PIPE, universal_newlines = True,
+                                encoding = "utf8")
+        try:
+            while True:
+                try:
+                    task = pending.get_nowait()
+                except queue.Empty:
+                    break
+                proc.stdin.write(json.dumps(task) + "\n")
+                proc.stdin.flush()
+                line = proc.stdout.readline()
+                if not line:
+                    results.put(RuntimeError(f"Worker exited: {worker_cmd}"))
+                    return
+                results.put(json.loads(line))
+        finally:
+            proc.stdin.close()
+            proc.wait()
+
+    threads = [threading.Thread(target = feed, args = (worker_cmd,), daemon = True)
+               for worker_cmd in worker_cmds]
+    for thread in threads:
+        thread.start()
+    for _ in tasks:
+        result = results.get()
+        if isinstance(result, Exception):
+            raise result
+        yield result
+
+def merge_results(results: List[Dict]) -> Tuple[List[GENDER], BiasAccumulator]:
+    """
+    Concatenate the shards' predicted genders in dataset order, and merge their counts.
+    """
+    genders = []
+    accumulator = BiasAccumulator()
+    for result in sorted(results, key = lambda result: result["start"]):
+        genders.extend(GENDER(gender) for gender in result["genders"])
+        accumulator.merge(BiasAccumulator.from_dict(result["counts"]))
+    return genders, accumulator
+
+def write_predictions(bi_fn: str, bi_offsets: np.ndarray, genders: List[GENDER], out_fn: str):
+    """
+    Write the predictions file of load_alignments.py (see output_predictions),
+    reading each instance's target sentence at its bitext offset.
+    """
+    with open(bi_fn, "rb") as fin, open(out_fn, "w", encoding = "utf8") as fout:
+        writer = csv.writer(fout, delimiter = ",")
+        writer.writerow(["Sentence", "Predicted gender"])
+        for offset, gender in zip(bi_offsets, genders):
+            tgt_sent = read_lines_at(fin, int(offset), 1)[0].strip().split(" ||| ")[1]
+            writer.writerow([tgt_sent, gender.name])
+
+def run_worker():
+    """
+    Serve shard tasks from stdin until it's closed.
+    Anything else printed goes to stderr, to keep stdout for results.
+    """
+    results_out = sys.stdout
+    sys.stdout = sys.stderr
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        result = evaluate_shard(json.loads(line))
+        results_out.write(json.dumps(result) + "\n")
+        results_out.flush()
+
+
+if __name__ == "__main__":
+    # Parse command line arguments
+    args = docopt(__doc__)
+    debug = args["--debug"]
+    if debug:
+        logging.basicConfig(level = logging.DEBUG)
+    else:
+        logging.basicConfig(level = logging.INFO)
+
+    if args["--worker"]:
+        run_worker()
+        sys.exit(0)
+
+    ds_fn = args["--ds"]
+    bi_fn = args["--bi"]
+    lang = args["--lang"]
+    out_fn = args["--out"]
+    align_fn = args["--align"]
+    aligner = args["--aligner"] or "fast_align"
+    align_model_fn = args["--align-model"]
+    shard_size = int(args["--shard-size"]) if args["--shard-size"] else SHARD_SIZE
+    num_workers = int(args["--workers"]) if args["--workers"] else os.cpu_count()
+    worker_cmds = args["--worker-cmd"]
+
+    if aligner == "fast_align":
+        if align_fn is None:
+            raise ValueError("--align is required with fast_align")
+        if not is_csr(align_fn):
+            align_fn = ensure_csr(align_fn, os.path.splitext(align_fn)[0] + ".csr")
+    elif (aligner != "ibm2") or (align_model_fn is None):
+        raise ValueError("Shards can only decode with a saved ibm2 model (--aligner=ibm2 --align-model=MODEL_FILE)")
+
+    ds_offsets, bi_inds, bi_offsets = index_files(ds_fn, bi_fn)
+    tasks = make_tasks(ds_fn, bi_fn, lang, align_fn, aligner, align_model_fn, shard_size,
+                       ds_offsets, bi_inds, bi_offsets)
+    logging.info(f"Evaluating {len(tasks)} shards")
+    if worker_cmds:
+        results = run_commands(tasks, worker_cmds)
+    else:
+        results = run_local(tasks, num_workers)
+    genders, accumulator = merge_results(list(tqdm(results, total = len(tasks), desc = "shards")))
+
+    write_predictions(bi_fn, bi_offsets, genders, out_fn)
+    print(json.dumps(accumulator.finalize()))
+
+    logging.info("DONE")
@@ -1,7 +1,10 @@
 """ Usage:
-    <file-name> --pro=PRO_FILE --ant=ANTI_FILE --trans=TRANSLATIONS_FILE [--debug]
+    <file-name> --trans=TRANSLATIONS_FILE [--pro=PRO_FILE] [--ant=ANTI_FILE] [--subset=NAME=FILE...] [--debug]
 
 Split translations to anti and pro sterotypical.
+Each subset (a dataset file, whose third column is the English sentence) is written to
+TRANSLATIONS_FILE.NAME, where --pro and --ant are shorthands for the "pro" and "ant" subsets.
+The translations are streamed once, and each subset is indexed by 64 bit sentence hashes.
 
 """
 # External imports
@@ -12,6 +15,8 @@ from pprint import pformat
 from docopt import docopt
 from pathlib import Path
 from tqdm import tqdm
+from typing import Dict, Set
+import hashlib
 import json
 
 # Local imports
@@ -19,13 +24,53 @@ import json
 
 #----
 
+def sentence_hash(sent: str) -> int:
+    """
+    64 bit hash of a sentence, stable across processes.
+    """
+    return int.from_bytes(hashlib.blake2b(sent.encode("utf8"), digest_size = 8).digest(), "little")
+
+def load_subset_index(subset_fn: str) -> Set[int]:
+    """
+    Hashes of the English sentences of a dataset file.
+    """
+    return set(sentence_hash(line.split("\t")[2]) for line in open(subset_fn, encoding = "utf8"))
+
+def split_translations(trans_fn: str, subsets: Dict[str, str]) -> Dict[str, int]:
+    """
+    Write the translations of each subset (name -> dataset file) to trans_fn.name,
+    in a single pass over trans_fn.
+    Return the number of lines written per subset.
+    """
+    indexes = {name: load_subset_index(subset_fn) for name, subset_fn in subsets.items()}
+    counts = dict.fromkeys(subsets, 0)
+    outputs = {name: open(f"{trans_fn}.{name}", "w", encoding = "utf8") for name in subsets}
+    try:
+        for trans_line in open(trans_fn, encoding = "utf8"):
+            en_hash = sentence_hash(trans_line.split(" ||| ")[0])
+            for name, index in indexes.items():
+                if en_hash in index:
+                    outputs[name].write(trans_line)
+                    counts[name] += 1
+    finally:
+        for fout in outputs.values():
+            fout.close()
+    return counts
+
+
 if __name__ == "__main__":
 
     # Parse command line arguments
     args = docopt(__doc__)
-    pro_fn = Path(args["--pro"])
-    ant_fn = Path(args["--ant"])
     trans_fn = Path(args["--trans"])
+    subsets = {}
+    if args["--pro"]:
+        subsets["pro"] = args["--pro"]
+    if args["--ant"]:
+        subsets["ant"] = args["--ant"]
+    for subset in args["--subset"]:
+        name, subset_fn = subset.split("=", 1)
+        subsets[name] = subset_fn
 
     # Determine logging level
     debug = args["--debug"]
@@ -35,28 +80,8 @@ if __name__ == "__main__":
         logging.basicConfig(level = logging.INFO)
 
     # Start computation
-    pro_sents = [line.split("\t")[2] for line in open(pro_fn, encoding = "utf8")]
-    ant_sents = [line.split("\t")[2] for line in open(ant_fn, encoding = "utf8")]
-    trans_lines = [line for line in open(trans_fn, encoding = "utf8")]
-
-    out_pro_fn = str(trans_fn)+".pro"
-    out_ant_fn = str(trans_fn)+".ant"
-    pro_cnt = 0
-    ant_cnt = 0
-
-    with open(out_pro_fn, "w", encoding = "utf8") as f_pro, \
-         open(out_ant_fn, "w", encoding = "utf8") as f_ant:
-        for trans_line in trans_lines:
-            en_sent = trans_line.split(" ||| ")[0]
-            if en_sent in ant_sents:
-                f_ant.write(trans_line)
-                ant_cnt += 1
-
-            if en_sent in pro_sents:
-                f_pro.write(trans_line)
-                pro_cnt += 1
-
-    logging.info(f"found {pro_cnt} pro sents and {ant_cnt} ant sents")
+    counts = split_translations(trans_fn, subsets)
+    logging.info("found " + " and ".join(f"{cnt} {name} sents" for name, cnt in counts.items()))
 
     # End
     logging.info("DONE")
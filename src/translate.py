@@ -1,5 +1,11 @@
 """ Usage:
-    <file-name> --trans=TRANSLATION_SERVICE --in=IN_FILE --src=SOURCE_LANGUAGE --tgt=TARGET_LANGUAGE --out=OUT_FILE [--debug]
+    <file-name> --trans=TRANSLATION_SERVICE --in=IN_FILE --src=SOURCE_LANGUAGE --tgt=TARGET_LANGUAGE --out=OUT_FILE [--workers=NUM_WORKERS] [--rate=REQUESTS_PER_SEC] [--retries=MAX_RETRIES] [--journal=JOURNAL_FILE] [--debug]
+
+--workers: max. in-flight requests (default 8).
+--rate: max. requests per second, defaults per service (see translation_engine.PROVIDER_SETTINGS).
+--retries: retries of a failed request, with exponential backoff (default 5).
+--journal: translations are logged there as each batch completes (default: OUT_FILE.journal.jsonl).
+           A rerun only translates the sentences missing from it, and OUT_FILE is written from it.
 """
 # External imports
 import logging
@@ -9,6 +15,7 @@ from pprint import pformat
 from docopt import docopt
 from collections import defaultdict
 from operator import itemgetter
+from functools import partial
 from tqdm import tqdm
 from google.cloud import translate
 import html
@@ -17,27 +24,19 @@ import html
 from bing_translate import bing_translate
 from google_translate import google_translate
 from amazon_translate import aws_translate
+from translation_engine import TranslationEngine
+from translation_journal import TranslationJournal, JOURNAL_SUFFIX
 #=-----
 
-BATCH_SIZE = 50 # Up to 128 should be fine?
-
-def chunks(l, n):
-    """
-    Yield successive n-sized chunks from l.
-    """
-    for i in range(0, len(l), n):
-        yield l[i:i + n]
-
-def batch_translate(trans_function, lines, tgt_lang, src_lang = None):
+def batch_translate(trans_function, lines, tgt_lang, src_lang = None, provider = None,
+                    on_batch = None, **settings):
     """
     Translate a list of sentences.
-    Take care of batching.
+    Take care of batching, concurrency, rate limits and retries
+    (see translation_engine.py).
     """
-    translations_dicts = []
-    for chunk in tqdm(list(chunks(lines, BATCH_SIZE)), desc=f"size {BATCH_SIZE} chunks"):
-        for out_dict in trans_function(chunk, tgt_lang, src_lang):
-            translations_dicts.append(out_dict)
-    return translations_dicts
+    engine = TranslationEngine.for_provider(provider, trans_function, **settings)
+    return engine.translate(lines, tgt_lang, src_lang, on_batch)
 
 TRANSLATION_SERVICE = {
     "google": google_translate,
@@ -53,6 +52,10 @@ if __name__ == "__main__":
     src_lang = args["--src"]
     tgt_lang = args["--tgt"]
     out_fn = args["--out"]
+    num_workers = int(args["--workers"]) if args["--workers"] else None
+    rate = float(args["--rate"]) if args["--rate"] else None
+    max_retries = int(args["--retries"]) if args["--retries"] is not None else None
+    journal_fn = args["--journal"] or out_fn + JOURNAL_SUFFIX
     debug = args["--debug"]
     if debug:
         logging.basicConfig(level = logging.DEBUG)
@@ -64,10 +67,12 @@ if __name__ == "__main__":
     trans_function = TRANSLATION_SERVICE[trans_service]
 
     lines = [line.strip() for line in open(inp_fn, encoding = "utf8")]
-    out_dicts = batch_translate(trans_function, lines, tgt_lang, src_lang)
-    with open(out_fn, "w", encoding = "utf8") as fout:
-        for out_dict in out_dicts:
-            fout.write("{} ||| {}\n".format(out_dict["input"],
-                                            out_dict["translatedText"]))
+    journal = TranslationJournal(journal_fn)
+    missing = journal.missing(trans_service, src_lang, tgt_lang, lines)
+    logging.info(f"Translating {len(missing)} sentences, the rest are found in {journal_fn}")
+    batch_translate(trans_function, missing, tgt_lang, src_lang, trans_service,
+                    num_workers = num_workers, rate = rate, max_retries = max_retries,
+                    on_batch = partial(journal.append, trans_service, src_lang, tgt_lang))
+    journal.materialize(trans_service, src_lang, tgt_lang, lines, out_fn)
 
     logging.info("DONE")
@@ -0,0 +1,345 @@
+""" Usage:
+    <file-name> --in=IN_FILE --src=SOURCE_LANGUAGE --tgt=TARGET_LANGUAGE --out=OUT_FILE [--max-items=MAX_ITEMS] [--max-chars=MAX_CHARS] [--latency=SECONDS] [--workers=NUM_WORKERS] [--rate=REQUESTS_PER_SEC] [--retries=MAX_RETRIES] [--debug]
+
+Concurrent batch translation with per-provider payload limits, rate limits and retries.
+Batches are sent from a pool of NUM_WORKERS threads (i.e., in-flight requests),
+each request waits for a token from the provider's token bucket, and transient
+failures (throttling, server errors, timeouts) are retried with exponential backoff.
+After any other failure, no new batches are sent.
+Each batch is packed with as many sentences as the provider's item and character
+limits allow, up to a target size learned from the observed latencies (see BatchSizer).
+
+As a script, translate IN_FILE with a dummy provider, which reverses each sentence
+after SECONDS (default 0) plus 1ms per 100 characters, to check the engine's
+throughput, batch sizes and rate limits without a translation service.
+"""
+# External imports
+import logging
+import pdb
+import time
+import random
+import threading
+from collections import deque
+from pprint import pprint
+from pprint import pformat
+from docopt import docopt
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from tqdm import tqdm
+from typing import Callable, Dict, List, Optional
+
+# Local imports
+
+#=-----
+
+NUM_WORKERS = 8
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0      # Seconds before the first retry, doubled on each retry
+BACKOFF_MAX = 60.0
+INITIAL_ITEMS = 10      # Sentences per request before any latency is observed
+
+# Retried failures: HTTP statuses (besides 5xx), and exception class names,
+# matched across requests, botocore and the builtins without importing them
+TRANSIENT_CODES = [408, 429]
+TRANSIENT_ERRORS = {"ConnectionError", "TimeoutError", "Timeout", "ConnectTimeoutError",
+                    "ReadTimeoutError", "EndpointConnectionError", "ConnectionClosedError"}
+
+# Per provider: max. sentences and characters per request (None: unlimited),
+# whether characters are counted as utf8 bytes, requests per second and burst size.
+# Systran isn't listed: it's translated by the Python 2 systran_translate.py
+# (see scripts/systran_language.sh), whose client can't run this engine.
+PROVIDER_SETTINGS = {
+    # v2 API: up to 128 segments, 5k characters recommended
+    "google": {"max_items": 128, "max_chars": 5000, "count_bytes": False, "rate": 10, "burst": 10},
+    # v3 API: up to 1000 array elements and 50k characters
+    "bing": {"max_items": 1000, "max_chars": 50000, "count_bytes": False, "rate": 5, "burst": 5},
+    # TranslateText: a single text of up to 10k bytes
+    "aws": {"max_items": 1, "max_chars": 10000, "count_bytes": True, "rate": 20, "burst": 20},
+}
+DEFAULT_SETTINGS = {"max_items": 50, "max_chars": None, "count_bytes": False, "rate": 5, "burst": 5}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: holds up to capacity tokens,
+    refilled at rate tokens per second.
+    rate = None doesn't limit.
+    """
+    def __init__(self, rate: Optional[float], capacity: float = 1):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1):
+        """
+        Block until the given number of tokens is available, and take them.
+        """
+        if self.rate is None:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class BatchSizer:
+    """
+    Learn the number of sentences per request from observed latencies.
+    Latency is fit as a fixed overhead plus a per-sentence cost over recent
+    requests, and the target is the size at which the overhead is amortized,
+    i.e., throughput reaches EFFICIENCY of its per-sentence limit.
+    Until there's enough data for a fit, or if latency doesn't grow with the size,
+    the target grows. Failed requests (e.g., timeouts or payload errors) halve it.
+    """
+    GROW = 1.5
+    EFFICIENCY = 0.9
+    WINDOW = 50         # Requests in the fit
+
+    def __init__(self, max_items: Optional[int], initial: int = INITIAL_ITEMS):
+        self.max_items = max_items
+        self.min_items = self.clip(initial)
+        self.target = self.min_items
+        self.observations = deque(maxlen = self.WINDOW)
+        self.lock = threading.Lock()
+
+    def clip(self, target: float) -> int:
+        target = max(1, int(target))
+        return target if self.max_items is None else min(target, self.max_items)
+
+    def fit(self):
+        """
+        Least squares (overhead, per-sentence cost) of the latencies,
+        or None with less than two distinct sizes.
+        """
+        sizes = [num_items for num_items, _ in self.observations]
+        latencies = [latency for _, latency in self.observations]
+        mean_size = sum(sizes) / len(sizes)
+        mean_latency = sum(latencies) / len(latencies)
+        var = sum((size - mean_size) ** 2 for size in sizes)
+        if var == 0:
+            return None
+        slope = sum((size - mean_size) * (latency - mean_latency)
+                    for size, latency in zip(sizes, latencies)) / var
+        return mean_latency - slope * mean_size, slope
+
+    def observe(self, num_items: int, latency: float):
+        with self.lock:
+            self.observations.append((num_items, latency))
+            fit = self.fit()
+            if (fit is None) or (fit[1] <= 0):
+                self.target = self.clip(max(self.target + 1, self.target * self.GROW))
+            else:
+                overhead, per_item = fit
+                amortized = self.EFFICIENCY / (1 - self.EFFICIENCY) * max(overhead, 0) / per_item
+                self.target = self.clip(max(self.min_items, amortized))
+        logging.debug(f"{num_items} sentences in {latency:.2f}s, target size: {self.target}")
+
+    def failed(self):
+        with self.lock:
+            self.target = self.clip(self.target // 2)
+
+
+def payload_size(sent: str, count_bytes: bool = False) -> int:
+    return len(sent.encode("utf8")) if count_bytes else len(sent)
+
+def pack_batch(lines: List[str], start: int, max_items: int, max_chars: Optional[int],
+               count_bytes: bool = False) -> int:
+    """
+    End index of the batch starting at start: as many sentences as fit in
+    max_items and max_chars. A single sentence over max_chars is sent alone.
+    """
+    end = start
+    chars = 0
+    while (end < len(lines)) and (end - start < max_items):
+        size = payload_size(lines[end], count_bytes)
+        if (max_chars is not None) and (end > start) and (chars + size > max_chars):
+            break
+        chars += size
+        end += 1
+    if (max_chars is not None) and (chars > max_chars):
+        logging.warning(f"Sentence {start} is over the {max_chars} characters limit")
+    return end
+
+
+def status_code(e: Exception) -> Optional[int]:
+    """
+    HTTP status of a provider error, if it has one: requests' and botocore's
+    response, or google.api_core's (and urllib's) code.
+    """
+    response = getattr(e, "response", None)
+    if isinstance(response, dict):
+        code = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    else:
+        code = getattr(response, "status_code", None)
+    if code is None:
+        code = getattr(e, "code", None)
+    return code if isinstance(code, int) else None
+
+def is_transient(e: Exception) -> bool:
+    """
+    Check if a failed request is worth retrying: throttling (429), server
+    errors (5xx), dropped connections and timeouts. Other errors (e.g., bad
+    credentials, an exhausted quota or a malformed request) fail the same way again.
+    """
+    code = status_code(e)
+    if code is not None:
+        return (code in TRANSIENT_CODES) or (code >= 500)
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(e).__mro__)
+
+def with_retries(func: Callable, *args, max_retries: int = MAX_RETRIES,
+                 backoff_base: float = BACKOFF_BASE, backoff_max: float = BACKOFF_MAX,
+                 retryable: Callable = is_transient):
+    """
+    Call func, retrying retryable failures with jittered exponential backoff.
+    Other failures, and the last one, are raised.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return func(*args)
+        except Exception as e:
+            if (attempt == max_retries) or (not retryable(e)):
+                raise
+            delay = min(backoff_max, backoff_base * (2 ** attempt)) * random.uniform(0.5, 1)
+            logging.warning(f"Request failed ({e!r}), retry {attempt + 1}/{max_retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+class TranslationEngine:
+    """
+    Translate batches of sentences concurrently with a trans_function
+    (e.g., google_translate), which maps (sents, target_language, source_language)
+    to a list of {"input", "translatedText"} dicts.
+    """
+    def __init__(self, trans_function: Callable, max_items: Optional[int] = DEFAULT_SETTINGS["max_items"],
+                 max_chars: Optional[int] = DEFAULT_SETTINGS["max_chars"], count_bytes: bool = False,
+                 num_workers: int = NUM_WORKERS, rate: Optional[float] = DEFAULT_SETTINGS["rate"],
+                 burst: float = DEFAULT_SETTINGS["burst"], max_retries: int = MAX_RETRIES,
+                 backoff_base: float = BACKOFF_BASE):
+        self.trans_function = trans_function
+        self.max_chars = max_chars
+        self.count_bytes = count_bytes
+        self.sizer = BatchSizer(max_items)
+        self.num_workers = num_workers
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+
+    @classmethod
+    def for_provider(cls, provider: str, trans_function: Callable, **overrides):
+        """
+        An engine with the provider's default settings (see PROVIDER_SETTINGS),
+        overridden by non-None keyword arguments.
+        """
+        settings = dict(PROVIDER_SETTINGS.get(provider, DEFAULT_SETTINGS))
+        settings.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(trans_function, **settings)
+
+    def translate_batch(self, sents: List[str], tgt_lang: str, src_lang: str = None) -> List[Dict]:
+        def request():
+            self.bucket.acquire()
+            start = time.monotonic()
+            try:
+                out_dicts = self.trans_function(sents, tgt_lang, src_lang)
+                if len(out_dicts) != len(sents):
+                    raise ValueError(f"Got {len(out_dicts)} translations for {len(sents)} sentences")
+            except Exception:
+                self.sizer.failed()
+                raise
+            self.sizer.observe(len(sents), time.monotonic() - start)
+            return out_dicts
+        return with_retries(request, max_retries = self.max_retries,
+                            backoff_base = self.backoff_base)
+
+    def translate(self, lines: List[str], tgt_lang: str, src_lang: str = None,
+                  on_batch: Callable = None) -> List[Dict]:
+        """
+        Translate a list of sentences, in order.
+        Each batch is packed when a worker is free, with the current target size.
+        on_batch, if given, is called with each batch's sentences and translations
+        as soon as it completes (e.g., to journal them).
+        Once a batch fails (all its retries, or a non-transient error), no new
+        batches are sent, and its error is raised when the running ones are done.
+        """
+        results = {}
+        error = None
+        start = 0
+        running = {}
+        num_requests = 0
+        with ThreadPoolExecutor(self.num_workers) as executor, \
+             tqdm(total = len(lines), desc = "sentences") as pbar:
+            while running or ((error is None) and (start < len(lines))):
+                while (error is None) and (start < len(lines)) and (len(running) < self.num_workers):
+                    end = pack_batch(lines, start, self.sizer.target, self.max_chars, self.count_bytes)
+                    future = executor.submit(self.translate_batch, lines[start : end], tgt_lang, src_lang)
+                    running[future] = (start, end)
+                    num_requests += 1
+                    start = end
+
+                finished, _ = wait(running, return_when = FIRST_COMPLETED)
+                for future in finished:
+                    batch_start, batch_end = running.pop(future)
+                    try:
+                        out_dicts = future.result()
+                    except Exception as e:
+                        logging.error(f"Sentences {batch_start}-{batch_end} failed: {e!r}")
+                        error = error or e
+                        continue
+                    if on_batch is not None:
+                        on_batch(lines[batch_start : batch_end], out_dicts)
+                    results[batch_start] = out_dicts
+                    pbar.update(batch_end - batch_start)
+
+        logging.info(f"Sent {num_requests} requests, final target size: {self.sizer.target}")
+        if error is not None:
+            raise error
+        return [out_dict for batch_start in sorted(results) for out_dict in results[batch_start]]
+
+
+def reverse_translate(sents, target_language, source_language = None, latency = 0):
+    """
+    Dummy provider.
+    """
+    time.sleep(latency + sum(map(len, sents)) / 100000)
+    return [{"input": sent, "translatedText": sent[::-1]} for sent in sents]
+
+
+if __name__ == "__main__":
+    # Parse command line arguments
+    args = docopt(__doc__)
+    inp_fn = args["--in"]
+    src_lang = args["--src"]
+    tgt_lang = args["--tgt"]
+    out_fn = args["--out"]
+    max_items = int(args["--max-items"]) if args["--max-items"] else None
+    max_chars = int(args["--max-chars"]) if args["--max-chars"] else None
+    latency = float(args["--latency"]) if args["--latency"] else 0
+    num_workers = int(args["--workers"]) if args["--workers"] else None
+    rate = float(args["--rate"]) if args["--rate"] else None
+    max_retries = int(args["--retries"]) if args["--retries"] is not None else None
+    debug = args["--debug"]
+    if debug:
+        logging.basicConfig(level = logging.DEBUG)
+    else:
+        logging.basicConfig(level = logging.INFO)
+
+    trans_function = lambda sents, tgt, src: reverse_translate(sents, tgt, src, latency)
+    engine = TranslationEngine.for_provider("reverse", trans_function, max_items = max_items,
+                                            max_chars = max_chars, num_workers = num_workers,
+                                            rate = rate, max_retries = max_retries)
+    lines = [line.strip() for line in open(inp_fn, encoding = "utf8")]
+    start = time.time()
+    out_dicts = engine.translate(lines, tgt_lang, src_lang)
+    logging.info(f"Translated {len(out_dicts)} sentences in {time.time() - start:.1f}s")
+    with open(out_fn, "w", encoding = "utf8") as fout:
+        for out_dict in out_dicts:
+            fout.write("{} ||| {}\n".format(out_dict["input"],
+                                            out_dict["translatedText"]))
+
+    logging.info("DONE")
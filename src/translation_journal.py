@@ -0,0 +1,134 @@
+""" Usage:
+    <file-name> --journal=JOURNAL_FILE --trans=TRANSLATION_SERVICE --in=IN_FILE --src=SOURCE_LANGUAGE --tgt=TARGET_LANGUAGE --out=OUT_FILE [--debug]
+
+Materialize the `src ||| tgt` translations of IN_FILE from a translation journal.
+Fails, listing the number of missing sentences, if some were never translated.
+"""
+# External imports
+import logging
+import pdb
+import os
+import json
+import fcntl
+from pprint import pprint
+from pprint import pformat
+from docopt import docopt
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Local imports
+from split_translations import sentence_hash
+#=-----
+
+JOURNAL_SUFFIX = ".journal.jsonl"
+
+
+def journal_prefix(provider: str, src_lang: str, tgt_lang: str) -> str:
+    return f"{provider}:{src_lang}-{tgt_lang}:"
+
+def journal_key(provider: str, src_lang: str, tgt_lang: str, sent: str) -> str:
+    return journal_prefix(provider, src_lang, tgt_lang) + f"{sentence_hash(sent):016x}"
+
+
+class TranslationJournal:
+    """
+    Append-only JSONL log of translations, keyed by provider,
+    language pair and source sentence hash (see journal_key).
+    Each batch is appended as soon as it's translated, so an interrupted
+    job loses at most its in-flight requests.
+    """
+    def __init__(self, journal_fn: str):
+        self.journal_fn = journal_fn
+        Path(journal_fn).parent.mkdir(parents = True, exist_ok = True)
+
+    def append(self, provider: str, src_lang: str, tgt_lang: str, sents: List[str],
+               out_dicts: List[Dict]):
+        """
+        Log a batch of sentences and their {"translatedText"} dicts, in a single write.
+        """
+        data = "".join(json.dumps({"key": journal_key(provider, src_lang, tgt_lang, sent),
+                                   "input": sent,
+                                   "translatedText": out_dict["translatedText"]},
+                                  ensure_ascii = False) + "\n"
+                       for sent, out_dict in zip(sents, out_dicts))
+        with open(self.journal_fn, "a", encoding = "utf8") as fout:
+            fcntl.flock(fout, fcntl.LOCK_EX)
+            try:
+                fout.write(data)
+                fout.flush()
+            finally:
+                fcntl.flock(fout, fcntl.LOCK_UN)
+
+    def load(self, provider: str, src_lang: str, tgt_lang: str) -> Dict[str, Tuple[str, str]]:
+        """
+        Journaled (source, translation) pairs of a provider and language pair,
+        by key (see journal_key).
+        A partially written last line (e.g., after a crash) is ignored.
+        """
+        prefix = journal_prefix(provider, src_lang, tgt_lang)
+        entries = {}
+        if not os.path.exists(self.journal_fn):
+            return entries
+        with open(self.journal_fn, encoding = "utf8") as fin:
+            for line_ind, line in enumerate(fin):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logging.warning(f"Skipping malformed line {line_ind} in {self.journal_fn}")
+                    continue
+                if entry["key"].startswith(prefix):
+                    entries[entry["key"]] = (entry["input"], entry["translatedText"])
+        return entries
+
+    def translations(self, provider: str, src_lang: str, tgt_lang: str,
+                     lines: List[str]) -> List[Optional[str]]:
+        """
+        The journaled translation of each line (None if there's none), looked up
+        by key. The source text is only compared to guard against hash collisions.
+        """
+        entries = self.load(provider, src_lang, tgt_lang)
+        translations = []
+        for line in lines:
+            entry = entries.get(journal_key(provider, src_lang, tgt_lang, line))
+            translations.append(entry[1] if (entry is not None) and (entry[0] == line) else None)
+        return translations
+
+    def missing(self, provider: str, src_lang: str, tgt_lang: str, lines: List[str]) -> List[str]:
+        """
+        Distinct sentences of lines which aren't journaled yet, in order.
+        """
+        translations = self.translations(provider, src_lang, tgt_lang, lines)
+        return list(dict.fromkeys(line for line, translation in zip(lines, translations)
+                                  if translation is None))
+
+    def materialize(self, provider: str, src_lang: str, tgt_lang: str, lines: List[str], out_fn: str):
+        """
+        Write the `src ||| tgt` file of lines from the journal.
+        """
+        translations = self.translations(provider, src_lang, tgt_lang, lines)
+        num_missing = sum(translation is None for translation in translations)
+        if num_missing:
+            raise ValueError(f"{num_missing} sentences are missing from {self.journal_fn}")
+        with open(out_fn, "w", encoding = "utf8") as fout:
+            for line, translation in zip(lines, translations):
+                fout.write("{} ||| {}\n".format(line, translation))
+
+if __name__ == "__main__":
+    # Parse command line arguments
+    args = docopt(__doc__)
+    journal_fn = args["--journal"]
+    trans_service = args["--trans"]
+    inp_fn = args["--in"]
+    src_lang = args["--src"]
+    tgt_lang = args["--tgt"]
+    out_fn = args["--out"]
+    debug = args["--debug"]
+    if debug:
+        logging.basicConfig(level = logging.DEBUG)
+    else:
+        logging.basicConfig(level = logging.INFO)
+
+    lines = [line.strip() for line in open(inp_fn, encoding = "utf8")]
+    TranslationJournal(journal_fn).materialize(trans_service, src_lang, tgt_lang, lines, out_fn)
+
+    logging.info("DONE")